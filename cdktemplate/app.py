@@ -4,13 +4,26 @@
 # SPDX-License-Identifier: MIT-0
 
 from aws_cdk import core
+import json
 import os
 
 os.environ["AMAZON_REVIEWS_BUCKET_ARN"] = "arn:aws:s3:::amazon-reviews-pds"
 os.environ["AMAZON_REVIEWS_OBJECT"] = "tsv/amazon_reviews_us_Camera_v1_00.tsv.gz"
+os.environ["AMAZON_REVIEWS_SHARDS"] = "1"
+os.environ["AMAZON_REVIEWS_INDEX_MB"] = "0"
+os.environ["AMAZON_REVIEWS_ROLLUPS"] = ""
+os.environ["AMAZON_REVIEWS_BLOOM_FILTER_COLUMNS"] = ""
+os.environ["AMAZON_REVIEWS_CLUSTER_COLUMNS"] = ""
+os.environ["AMAZON_REVIEWS_CLUSTER_ORDER"] = "sort"
 
 os.environ["NYC_TLC_BUCKET_ARN"] = "arn:aws:s3:::nyc-tlc"
 os.environ["NYC_TLC_OBJECT"] = "trip data/green_tripdata_2020-06.csv"
+os.environ["NYC_TLC_SHARDS"] = "1"
+os.environ["NYC_TLC_INDEX_MB"] = "0"
+os.environ["NYC_TLC_ROLLUPS"] = ""
+os.environ["NYC_TLC_BLOOM_FILTER_COLUMNS"] = ""
+os.environ["NYC_TLC_CLUSTER_COLUMNS"] = ""
+os.environ["NYC_TLC_CLUSTER_ORDER"] = "sort"
 
 from stacks.amazonreviews_stack import AmazonReviewsDatasetStack
 from stacks.nyctlc_stack import NycTlcDatasetStack
@@ -21,4 +34,10 @@ AmazonReviewsDatasetStack(app, "amazon-reviews-dataset-stack")
 NycTlcDatasetStack(app, "nyc-tlc-dataset-stack")
 S3AccessPointFromTable(app, "s3-accesspoint-fromtable")
 
+# Optional: JSON file with a list of {"RoleArn": ..., "VpcId": ...} to share the table with many grantees
+grantees_file = os.environ.get("S3_ACCESSPOINT_GRANTEES_FILE")
+if grantees_file:
+	with open(grantees_file, encoding="utf8") as fp:
+		S3AccessPointFromTable(app, "s3-accesspoint-fromtable-grantees", grantees=json.load(fp))
+
 app.synth()
@@ -0,0 +1,34 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Same interface as the cfnresponse module that Lambda only provides to inline code (ZipFile),
+# for the functions deployed from this folder as an asset.
+
+import json
+import urllib.request
+
+SUCCESS = "SUCCESS"
+FAILED = "FAILED"
+
+def send(event, context, responseStatus, responseData, physicalResourceId=None, noEcho=False, reason=None):
+
+	responseBody = {
+		"Status": responseStatus,
+		"Reason": reason or "See the details in CloudWatch Log Stream: " + context.log_stream_name,
+		"PhysicalResourceId": physicalResourceId or context.log_stream_name,
+		"StackId": event["StackId"],
+		"RequestId": event["RequestId"],
+		"LogicalResourceId": event["LogicalResourceId"],
+		"NoEcho": noEcho,
+		"Data": responseData
+	}
+	body = json.dumps(responseBody).encode("utf8")
+	print("Response body: %s" % body)
+
+	# The presigned URL is signed for an empty content type
+	request = urllib.request.Request(event["ResponseURL"], data=body, method="PUT", headers={"Content-Type": "", "Content-Length": str(len(body))})
+	try:
+		with urllib.request.urlopen(request) as response:
+			print("Status code: %s" % response.status)
+	except Exception as e:
+		print("send(..) failed executing request: %s" % e)
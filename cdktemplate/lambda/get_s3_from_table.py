@@ -3,6 +3,7 @@
 
 import cfnresponse
 import boto3
+import os
 from botocore.exceptions import ClientError
 
 glue = boto3.client("glue")
@@ -25,16 +26,7 @@ def create_resource(event, context):
 	glue_database = event["ResourceProperties"]["GlueDatabase"]
 
 	try:
-		response = glue.get_table(
-			DatabaseName=glue_database,
-			Name=glue_table
-		)
-
-		location = response["Table"]["StorageDescriptor"]["Location"]
-		print(location)
-
-		table_bucket = location.split("/")[2]
-		table_prefix = "/".join(location.split("/")[3:])
+		table_bucket, table_prefix = get_table_location(glue_database, glue_table)
 
 		response = {
 			"TableBucket" : table_bucket,
@@ -43,26 +35,49 @@ def create_resource(event, context):
 
 		cfnresponse.send(event, context, cfnresponse.SUCCESS, response)
 
-	except ClientError as e:
+	except (ClientError, ValueError) as e:
 		print("Unexpected error: %s" % e)
 		cfnresponse.send(event, context, cfnresponse.FAILED, {})
 
+def get_table_location(glue_database, glue_table):
+
+	response = glue.get_table(
+		DatabaseName=glue_database,
+		Name=glue_table
+	)
+
+	locations = [response["Table"]["StorageDescriptor"]["Location"]]
+
+	# Partitions may live outside the table location (e.g. hash-sharded layouts), so the
+	# returned prefix is the longest common prefix covering the table and all its partitions.
+	if response["Table"].get("PartitionKeys"):
+		paginator = glue.get_paginator("get_partitions")
+		for page in paginator.paginate(DatabaseName=glue_database, TableName=glue_table):
+			locations.extend(p["StorageDescriptor"]["Location"] for p in page["Partitions"])
+
+	print(locations)
+
+	buckets = set(location.split("/")[2] for location in locations)
+	if len(buckets) > 1:
+		raise ValueError("Table %s.%s spans more than one bucket: %s" % (glue_database, glue_table, sorted(buckets)))
+
+	table_bucket = buckets.pop()
+	prefixes = ["/".join(location.split("/")[3:]) for location in locations]
+	table_prefix = os.path.commonprefix(prefixes)
+
+	if table_prefix not in prefixes:
+		# Cut at the last delimiter so the prefix does not end in the middle of a key name.
+		table_prefix = table_prefix[:table_prefix.rfind("/") + 1]
+
+	return table_bucket, table_prefix
+
 def update_resource(event, context):
 
 	glue_table = event["ResourceProperties"]["GlueTable"]
 	glue_database = event["ResourceProperties"]["GlueDatabase"]
 	
 	try:
-		response = glue.get_table(
-			DatabaseName=glue_database,
-			Name=glue_table
-		)
-
-		location = response["Table"]["StorageDescriptor"]["Location"]
-		print(location)
-
-		table_bucket = location.split("/")[2]
-		table_prefix = "/".join(location.split("/")[3:])
+		table_bucket, table_prefix = get_table_location(glue_database, glue_table)
 
 		response = {
 			"TableBucket" : table_bucket,
@@ -71,7 +86,7 @@ def update_resource(event, context):
 
 		cfnresponse.send(event, context, cfnresponse.SUCCESS, response)
 		
-	except ClientError as e:
+	except (ClientError, ValueError) as e:
 		print("Unexpected error: %s." % e)
 		cfnresponse.send(event, context, cfnresponse.FAILED, {})
 
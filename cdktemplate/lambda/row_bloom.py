@@ -0,0 +1,106 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Per-object Bloom filters on key columns, written as sidecars so consumers can skip the
+# objects that definitely do not contain a value. The number of rows of an object is not
+# known while it is streamed, so each column uses a scalable Bloom filter: a new filter,
+# larger and with a tighter false positive rate, is added whenever the last one is full.
+
+import base64
+import hashlib
+import math
+
+INITIAL_CAPACITY = 16384
+GROWTH = 4
+TIGHTENING = 0.5
+
+def value_hashes(value):
+
+	digest = hashlib.md5(value).digest()
+	return int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big")
+
+class BloomFilter(object):
+
+	def __init__(self, capacity, false_positive_rate):
+
+		self.capacity = capacity
+		self.bits = max(8, int(math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)))
+		self.hashes = max(1, int(round(self.bits / capacity * math.log(2))))
+		self.count = 0
+		self.data = bytearray((self.bits + 7) // 8)
+
+	def add(self, h1, h2):
+
+		for i in range(self.hashes):
+			position = (h1 + i * h2) % self.bits
+			self.data[position >> 3] |= 1 << (position & 7)
+		self.count += 1
+
+	def contains(self, h1, h2):
+
+		return all(self.data[p >> 3] & (1 << (p & 7)) for p in ((h1 + i * h2) % self.bits for i in range(self.hashes)))
+
+	def result(self):
+
+		return {
+			"Bits": self.bits,
+			"Hashes": self.hashes,
+			"Count": self.count,
+			"Data": base64.b64encode(bytes(self.data)).decode("ascii")
+		}
+
+class ScalableBloomFilter(object):
+
+	def __init__(self, false_positive_rate):
+
+		self.false_positive_rate = false_positive_rate
+		self.filters = []
+
+	def add(self, value):
+
+		# Repeated values (e.g. the customer of many reviews) must not fill the filters: they are
+		# counted once, or a filter would be considered full before its capacity of distinct values.
+		h1, h2 = value_hashes(value)
+		if any(f.contains(h1, h2) for f in self.filters):
+			return
+
+		if not self.filters or self.filters[-1].count >= self.filters[-1].capacity:
+			n = len(self.filters)
+			# Rates of the successive filters add up to at most false_positive_rate
+			self.filters.append(BloomFilter(INITIAL_CAPACITY * GROWTH ** n, self.false_positive_rate * (1 - TIGHTENING) * TIGHTENING ** n))
+
+		self.filters[-1].add(h1, h2)
+
+class ColumnBloomFilters(object):
+
+	# Sidecar with one scalable Bloom filter for each configured column of an object.
+	# columns: [{"Column": name, "Index": position in the source rows}]
+
+	kind = "bloom"
+
+	def __init__(self, columns, delimiter, false_positive_rate):
+
+		# CloudFormation passes custom resource properties as strings
+		self.columns = [(c["Column"], int(c["Index"])) for c in columns]
+		self.delimiter = delimiter.encode("utf8")
+		self.filters = dict((name, ScalableBloomFilter(false_positive_rate)) for name, _ in self.columns)
+
+	def header(self, line):
+
+		pass
+
+	def add(self, line):
+
+		fields = line.rstrip(b"\r\n").split(self.delimiter)
+		for name, i in self.columns:
+			if i < len(fields) and fields[i]:
+				self.filters[name].add(fields[i])
+
+	def result(self):
+
+		return {
+			"Columns": dict(
+				(name, [f.result() for f in bloom.filters])
+				for name, bloom in self.filters.items()
+			)
+		}
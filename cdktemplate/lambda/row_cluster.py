@@ -0,0 +1,235 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Clustering of the rows of a dataset while it is loaded, so each object (and each indexed
+# chunk) covers a narrow range of the clustering columns and their min/max statistics can be
+# used to skip it. Rows are ordered with an external merge sort: runs of bounded size are
+# sorted in memory and spilled, then merged as streams, so memory does not depend on the size
+# of the dataset. With "zorder", rows follow a Z-order curve over the quantiles of the columns
+# instead of a lexicographic order, so every column keeps some locality.
+
+import bisect
+import heapq
+import math
+
+RUN_SIZE = 32 * 1024 * 1024
+# Runs merged at once, each merged run keeps a read stream (and its buffer) open
+MAX_MERGE_RUNS = 16
+ZORDER_BITS = 10
+ZORDER_SAMPLE_ROWS = 10000
+
+NULL_NUMBER = float("-inf")
+
+def parse_number(field):
+
+	try:
+		value = float(field)
+	except ValueError:
+		return NULL_NUMBER
+	# NaN would break the sort order
+	return value if math.isfinite(value) else NULL_NUMBER
+
+class Clustering(object):
+
+	# spec: {"Order": "sort"|"zorder", "Columns": [{"Column": name, "Index": i, "Type": "number"|"string"}]}
+	# Empty or invalid values sort first, and are ignored by the statistics (as NULLs in SQL).
+
+	def __init__(self, spec, delimiter, run_size=RUN_SIZE):
+
+		self.order = spec.get("Order") or "sort"
+		# CloudFormation passes custom resource properties as strings
+		self.columns = [(c["Column"], int(c["Index"]), parse_number if c["Type"] == "number" else bytes) for c in spec["Columns"]]
+		self.delimiter = delimiter.encode("utf8")
+		self.run_size = run_size
+		self.boundaries = None
+
+	def values(self, line):
+
+		fields = line.rstrip(b"\r\n").split(self.delimiter)
+		return tuple(parse(fields[i]) if i < len(fields) else parse(b"") for _, i, parse in self.columns)
+
+	def fit(self, lines):
+
+		# Z-order needs comparable coordinates for every column: values are mapped to their
+		# quantile bucket, from a sample of the rows.
+		if self.order != "zorder":
+			return
+
+		samples = [self.values(line) for line in lines]
+		buckets = 2 ** ZORDER_BITS
+		self.boundaries = []
+		for n in range(len(self.columns)):
+			column = sorted(values[n] for values in samples)
+			self.boundaries.append(sorted(set(column[len(column) * b // buckets] for b in range(1, buckets))) if column else [])
+
+	def key(self, line):
+
+		values = self.values(line)
+		if self.order != "zorder":
+			return values
+
+		# Ranks are spread over the same number of bits for every column, including those with
+		# fewer distinct values than buckets, so no column is left out of the high bits.
+		z = 0
+		ranks = [
+			bisect.bisect_right(boundaries, value) * 2 ** ZORDER_BITS // (len(boundaries) + 1)
+			for boundaries, value in zip(self.boundaries, values)
+		]
+		for bit in range(ZORDER_BITS - 1, -1, -1):
+			for rank in ranks:
+				z = (z << 1) | ((rank >> bit) & 1)
+		return z, values
+
+	def sort(self, lines, write_run, read_run):
+
+		# write_run(sorted lines) stores a run and returns a handle, read_run(handle) streams it back.
+		# Returns the size of the rows, known once they are all read, and the rows in order.
+		run = []
+		run_bytes = 0
+		size = 0
+		runs = []
+		newline = b"\n"
+
+		for line in lines:
+			if line.endswith(b"\n"):
+				newline = b"\r\n" if line.endswith(b"\r\n") else b"\n"
+			else:
+				# Last line of the source, it must not be glued to the next one of its run. It
+				# gets the line terminator of the source (e.g. CRLF).
+				line += newline
+
+			run.append(line)
+			run_bytes += len(line)
+			size += len(line)
+			if run_bytes >= self.run_size:
+				runs.append(write_run(sorted(run, key=self.key)))
+				run = []
+				run_bytes = 0
+
+		if not runs:
+			return size, iter(sorted(run, key=self.key))
+
+		if run:
+			runs.append(write_run(sorted(run, key=self.key)))
+		run = None
+
+		# Intermediate passes merge groups of runs into longer runs, until the last pass can
+		# stream all of them at once.
+		while len(runs) > MAX_MERGE_RUNS:
+			print("Merging %d sorted runs by groups of %d" % (len(runs), MAX_MERGE_RUNS))
+			runs = [
+				write_run(heapq.merge(*[read_run(handle) for handle in runs[n:n + MAX_MERGE_RUNS]], key=self.key))
+				for n in range(0, len(runs), MAX_MERGE_RUNS)
+			]
+
+		print("Merging %d sorted runs" % len(runs))
+		return size, heapq.merge(*[read_run(handle) for handle in runs], key=self.key)
+
+class ColumnStats(object):
+
+	# Sidecar with the min/max of the clustering columns for an object and, when chunk_size is
+	# given, for each chunk of the record index (same boundaries, matched by Offset).
+
+	kind = "stats"
+
+	def __init__(self, clustering, chunk_size=0):
+
+		self.clustering = clustering
+		self.chunk_size = chunk_size
+		self.size = 0
+		self.min = [None] * len(clustering.columns)
+		self.max = [None] * len(clustering.columns)
+		self.chunks = []
+
+	def header(self, line):
+
+		self.size = len(line)
+
+	def add(self, line):
+
+		values = self.clustering.values(line)
+
+		if self.chunk_size:
+			if not self.chunks or self.size - self.chunks[-1]["Offset"] >= self.chunk_size:
+				self.chunks.append({"Offset": self.size, "Min": [None] * len(values), "Max": [None] * len(values)})
+			bounds = [(self.min, self.max), (self.chunks[-1]["Min"], self.chunks[-1]["Max"])]
+		else:
+			bounds = [(self.min, self.max)]
+
+		for n, value in enumerate(values):
+			if value == NULL_NUMBER or value == b"":
+				continue
+			for low, high in bounds:
+				if low[n] is None or value < low[n]:
+					low[n] = value
+				if high[n] is None or value > high[n]:
+					high[n] = value
+
+		self.size += len(line)
+
+	def _json(self, values):
+
+		return dict(
+			(name, value.decode("utf8", "replace") if isinstance(value, bytes) else value)
+			for (name, _, _), value in zip(self.clustering.columns, values)
+		)
+
+	def result(self):
+
+		result = {"Size": self.size, "Min": self._json(self.min), "Max": self._json(self.max)}
+		if self.chunk_size:
+			result["Chunks"] = [{"Offset": c["Offset"], "Min": self._json(c["Min"]), "Max": self._json(c["Max"])} for c in self.chunks]
+		return result
+
+def overlaps(stats, column, low, high):
+
+	# Statistics without a value for the column (e.g. only NULLs) can be skipped.
+	if stats["Min"].get(column) is None:
+		return False
+	return not (high < stats["Min"][column] or low > stats["Max"][column])
+
+def pruning_report(benchmarks, objects):
+
+	# benchmarks: [{"Name": ..., "Column": ..., "Min": ..., "Max": ...}] range predicates.
+	# objects: stats sidecar results of the objects written. Reports the fraction of the bytes
+	# that min/max statistics let a reader skip, at the object and at the chunk level. Objects
+	# can only be skipped as a whole when the rows are spread across shards.
+
+	total = sum(stats["Size"] for stats in objects)
+	report = []
+
+	for benchmark in benchmarks:
+		column = benchmark["Column"]
+		low, high = benchmark["Min"], benchmark["Max"]
+		if isinstance(next((s["Min"][column] for s in objects if s["Min"].get(column) is not None), ""), float):
+			low, high = float(low), float(high)
+
+		object_bytes = 0
+		chunk_bytes = 0
+		for stats in objects:
+			if not overlaps(stats, column, low, high):
+				continue
+			object_bytes += stats["Size"]
+
+			chunks = stats.get("Chunks")
+			if not chunks:
+				chunk_bytes += stats["Size"]
+				continue
+			for chunk, following in zip(chunks, chunks[1:] + [{"Offset": stats["Size"]}]):
+				if overlaps(chunk, column, low, high):
+					chunk_bytes += following["Offset"] - chunk["Offset"]
+
+		report.append({
+			"Name": benchmark["Name"],
+			"Column": column,
+			"Min": benchmark["Min"],
+			"Max": benchmark["Max"],
+			"Bytes": total,
+			"ObjectPruningRatio": round(1 - object_bytes / total, 4) if total else 0.0,
+			"ChunkPruningRatio": round(1 - chunk_bytes / total, 4) if total else 0.0,
+			"Objects": len(objects)
+		})
+		if len(objects) < 2:
+			report[-1]["Note"] = "Single object, object level pruning needs more than one shard"
+
+	return report
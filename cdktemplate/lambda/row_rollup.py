@@ -0,0 +1,63 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Rollups (group by + count/sum) computed over the rows of a dataset while it is being
+# loaded, so consumers can read a small aggregate table instead of scanning the dataset.
+
+from collections import defaultdict
+
+def escape(value):
+
+	# Group by values are free text (e.g. a comma in a TSV column): they are escaped with a
+	# backslash, as read by the Glue table of the rollup (LazySimpleSerDe with escape.delim).
+	return value.replace(b"\\", b"\\\\").replace(b",", b"\\,")
+
+class Rollup(object):
+
+	# spec: {"Key": ..., "GroupBy": [{"Index": i, "Length": n}], "Aggregates": [{"Function": "count"|"sum", "Index": j}]}
+	# where indexes are column positions in the source rows and Length optionally truncates a
+	# group by value (e.g. 10 to get the date of a timestamp).
+
+	def __init__(self, spec, delimiter):
+
+		self.key = spec["Key"]
+		self.columns = spec["Columns"]
+		# CloudFormation passes custom resource properties as strings
+		self.group_by = [(int(g["Index"]), int(g.get("Length") or 0)) for g in spec["GroupBy"]]
+		self.sums = [int(a["Index"]) for a in spec["Aggregates"] if a["Function"] == "sum"]
+		self.functions = [a["Function"] for a in spec["Aggregates"]]
+		self.delimiter = delimiter.encode("utf8")
+
+		# Per group: [row count, sum of each summed column]
+		self.groups = defaultdict(lambda: [0] + [0.0] * len(self.sums))
+
+	def add(self, line):
+
+		fields = line.rstrip(b"\r\n").split(self.delimiter)
+		try:
+			group = tuple(fields[i][:length] if length else fields[i] for i, length in self.group_by)
+		except IndexError:
+			# Malformed row
+			return
+
+		values = self.groups[group]
+		values[0] += 1
+
+		for n, i in enumerate(self.sums):
+			try:
+				values[n + 1] += float(fields[i])
+			except (IndexError, ValueError):
+				# Empty values are ignored, as NULLs in SQL
+				pass
+
+	def result(self):
+
+		lines = [",".join(self.columns).encode("utf8") + b"\n"]
+
+		for group in sorted(self.groups):
+			values = self.groups[group]
+			sums = iter(values[1:])
+			aggregates = [str(values[0]) if f == "count" else repr(round(next(sums), 6)) for f in self.functions]
+			lines.append(b",".join([escape(value) for value in group] + [a.encode("utf8") for a in aggregates]) + b"\n")
+
+		return b"".join(lines)
@@ -0,0 +1,35 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Deterministic row sampling for dev and test loads. Rows are selected by a seeded hash of
+# their content instead of a random generator, so the same seed always yields the same sample.
+
+import hashlib
+import heapq
+
+HASH_RANGE = 2 ** 64
+
+def row_hash(seed, line):
+
+	return int.from_bytes(hashlib.md5(seed + line.rstrip(b"\r\n")).digest()[:8], "big")
+
+def fraction_sample(lines, fraction, seed):
+
+	threshold = int(fraction * HASH_RANGE)
+	for line in lines:
+		if row_hash(seed, line) < threshold:
+			yield line
+
+def reservoir_sample(lines, rows, seed):
+
+	# Bottom-k sampling: keeps the `rows` rows with the smallest hashes, in their original order.
+	heap = []
+	for position, line in enumerate(lines):
+		entry = (-row_hash(seed, line), position, line)
+		if len(heap) < rows:
+			heapq.heappush(heap, entry)
+		elif entry[0] > heap[0][0]:
+			heapq.heapreplace(heap, entry)
+
+	for _, _, line in sorted(heap, key=lambda entry: entry[1]):
+		yield line
@@ -3,9 +3,32 @@
 
 import cfnresponse
 import boto3
+import json
 from botocore.exceptions import ClientError
+from s3_throttle import AimdController, client_config
+from row_bloom import ColumnBloomFilters
+from row_cluster import ZORDER_SAMPLE_ROWS, Clustering, ColumnStats, pruning_report
+from row_rollup import Rollup
+from row_sample import fraction_sample, reservoir_sample
+from s3_stream import MIN_PART_SIZE, WRITE_PART_SIZE, ObjectWriter, RecordIndex, is_gzip, iter_lines, open_source, part_key, sidecar_key
 
-s3 = boto3.client("s3")
+MAX_CONCURRENCY = 32
+PART_SIZE = 64 * 1024 * 1024
+DELETE_BATCH_SIZE = 1000
+CLUSTERING_FOLDER = "_clustering"
+
+# Latency (s) above which concurrency stops growing, for the operations that move data.
+# Others use the controller default, sized for requests without a body.
+LATENCY_TARGETS = {
+	"copy_object": 30.0,
+	"copy_part": 30.0,
+	"upload_part": 10.0,
+	"put_object": 10.0,
+	"complete_multipart_upload": 10.0,
+	"delete_batch": 10.0
+}
+
+s3 = boto3.client("s3", config=client_config(MAX_CONCURRENCY))
 
 def handler(event, context):
 
@@ -21,63 +44,331 @@ def handler(event, context):
 
 def create_resource(event, context):
 
-	public_dataset_bucket = event["ResourceProperties"]["PublicDatasetBucket"]
 	local_dataset_bucket = event["ResourceProperties"]["LocalDatasetBucket"]
-	public_dataset_object = event["ResourceProperties"]["PublicDatasetObject"]
-	local_dataset_prefix = event["ResourceProperties"]["LocalDatasetPrefix"]
 
-	local_dataset_object = local_dataset_prefix + "/" + public_dataset_object.split("/")[1]
+	controller = AimdController("Load", maximum=MAX_CONCURRENCY, latency_targets=LATENCY_TARGETS)
 
 	try:
-		s3.copy(
-			{'Bucket': public_dataset_bucket, 'Key': public_dataset_object}, 
-			local_dataset_bucket, 
-			local_dataset_object
-		)
+		load_dataset(controller, event["ResourceProperties"])
 
 		cfnresponse.send(event, context, cfnresponse.SUCCESS, {})
 
-	except ClientError as e:
+	except Exception as e:
+		# Any failure must be reported, or the stack waits for the custom resource to time out.
 		print("Unexpected error: %s" % e)
 		cfnresponse.send(event, context, cfnresponse.FAILED, {})
 
+	finally:
+		controller.emit_metrics({"Bucket": local_dataset_bucket})
+
 def update_resource(event, context):
 
+	old_properties = dict(event["OldResourceProperties"], ServiceToken=None)
+	new_properties = dict(event["ResourceProperties"], ServiceToken=None)
+
+	local_dataset_bucket = new_properties["LocalDatasetBucket"]
+
+	controller = AimdController("Reload", maximum=MAX_CONCURRENCY, latency_targets=LATENCY_TARGETS)
+
 	try:
+		# Only a change in the dataset properties (e.g. the layout) requires loading the data again.
+		if old_properties != new_properties:
+			delete_dataset(controller, old_properties)
+			load_dataset(controller, new_properties)
+
 		cfnresponse.send(event, context, cfnresponse.SUCCESS, {})
 		
-	except ClientError as e:
+	except Exception as e:
 		print("Unexpected error: %s." % e)
 		cfnresponse.send(event, context, cfnresponse.FAILED, {})
 
+	finally:
+		controller.emit_metrics({"Bucket": local_dataset_bucket})
+
 def delete_resource(event, context):
 	
 	local_dataset_bucket = event["ResourceProperties"]["LocalDatasetBucket"]
-	public_dataset_object = event["ResourceProperties"]["PublicDatasetObject"]
-	local_dataset_prefix = event["ResourceProperties"]["LocalDatasetPrefix"]
 
-	local_dataset_object = local_dataset_prefix + "/" + public_dataset_object.split("/")[1]
+	controller = AimdController("Delete", maximum=MAX_CONCURRENCY, latency_targets=LATENCY_TARGETS)
 
 	try:
-		# Verify if object exists. If not, exit with SUCCESS too.
+		# If no objects are found, exit with SUCCESS too.
+		delete_dataset(controller, event["ResourceProperties"])
+
+		cfnresponse.send(event, context, cfnresponse.SUCCESS, {})
+		
+	except Exception as e:
+		print("Unexpected error: %s." % e)
+		cfnresponse.send(event, context, cfnresponse.FAILED, {})
+
+	finally:
+		controller.emit_metrics({"Bucket": local_dataset_bucket})
+
+def load_dataset(controller, properties):
+
+	public_dataset_bucket = properties["PublicDatasetBucket"]
+	local_dataset_bucket = properties["LocalDatasetBucket"]
+	public_dataset_object = properties["PublicDatasetObject"]
+	local_dataset_prefix = properties["LocalDatasetPrefix"]
+	shard_prefixes = properties.get("LocalDatasetShardPrefixes") or []
+	index_chunk_size = int(properties.get("LocalDatasetIndexChunkSize") or 0)
+	sample_fraction = float(properties.get("LocalDatasetSampleFraction") or 1)
+	sample_rows = int(properties.get("LocalDatasetSampleRows") or 0)
+	sample_seed = properties.get("LocalDatasetSampleSeed") or ""
+	delimiter = properties.get("LocalDatasetDelimiter") or ","
+	rollups = [Rollup(spec, delimiter) for spec in properties.get("LocalDatasetRollups") or []]
+	bloom_filter_columns = properties.get("LocalDatasetBloomFilterColumns") or []
+	bloom_filter_rate = float(properties.get("LocalDatasetBloomFilterFalsePositiveRate") or 0.01)
+	clustering_spec = properties.get("LocalDatasetClustering") or {}
+
+	object_name = public_dataset_object.split("/")[-1]
+
+	# Compressed objects cannot be read by byte ranges, so they are not indexed.
+	indexed = index_chunk_size and not is_gzip(public_dataset_object)
 
-		s3.head_object(
+	sidecar_factories = []
+	if indexed:
+		sidecar_factories.append(lambda: RecordIndex(index_chunk_size))
+
+	if bloom_filter_columns:
+		sidecar_factories.append(lambda: ColumnBloomFilters(bloom_filter_columns, delimiter, bloom_filter_rate))
+
+	sample = None
+	if sample_rows > 0:
+		sample = lambda lines: reservoir_sample(lines, sample_rows, sample_seed.encode("utf8"))
+	elif sample_fraction < 1:
+		sample = lambda lines: fraction_sample(lines, sample_fraction, sample_seed.encode("utf8"))
+
+	clustering = None
+	cluster = None
+	stats = []
+	run_keys = []
+	if clustering_spec.get("Columns"):
+		clustering = Clustering(clustering_spec, delimiter)
+
+		if clustering.order == "zorder":
+			lines = iter_lines(open_source(s3, controller, public_dataset_bucket, public_dataset_object))
+			next(lines, b"")
+			clustering.fit(reservoir_sample(lines, ZORDER_SAMPLE_ROWS, b""))
+
+		def column_stats():
+			stats.append(ColumnStats(clustering, index_chunk_size if indexed else 0))
+			return stats[-1]
+
+		def write_run(lines):
+			# Runs are spilled gzipped to the hidden _clustering/ folder, as /tmp may be smaller than the dataset.
+			writer = ObjectWriter(s3, controller, local_dataset_bucket, "%s/%s/run-%05d.gz" % (local_dataset_prefix, CLUSTERING_FOLDER, len(run_keys)), compress=True)
+			try:
+				for line in lines:
+					writer.write(line)
+				writer.close()
+			except Exception:
+				writer.abort()
+				raise
+			run_keys.append(writer.key)
+			return writer.key
+
+		def read_run(key):
+			return iter_lines(open_source(s3, controller, local_dataset_bucket, key))
+
+		sidecar_factories.append(column_stats)
+		cluster = lambda lines: clustering.sort(lines, write_run, read_run)
+
+	if shard_prefixes or sample or clustering:
+		write_objects(controller, public_dataset_bucket, public_dataset_object, local_dataset_bucket, local_dataset_prefix, shard_prefixes, sidecar_factories, sample, rollups, cluster)
+		delete_keys(controller, local_dataset_bucket, run_keys)
+	else:
+		local_dataset_object = local_dataset_prefix + "/" + object_name
+		copy_object(controller, public_dataset_bucket, public_dataset_object, local_dataset_bucket, local_dataset_object)
+
+		sidecars = [factory() for factory in sidecar_factories]
+		if sidecars or rollups:
+			# The copy is server side, so sidecars and rollups are computed by a read only pass over the source.
+			scan_rows(controller, public_dataset_bucket, public_dataset_object, sidecars, sidecars + rollups)
+			put_sidecars(controller, local_dataset_bucket, local_dataset_prefix, local_dataset_object, sidecars)
+
+	for rollup in rollups:
+		controller.call(s3.put_object,
 			Bucket=local_dataset_bucket,
-			Key=local_dataset_object
+			Key=local_dataset_prefix + "/" + rollup.key,
+			Body=rollup.result()
 		)
 
-		s3.delete_object(
-		    Bucket=local_dataset_bucket,
-		    Key=local_dataset_object
+	if clustering:
+		report = pruning_report(clustering_spec.get("Benchmarks") or [], [s.result() for s in stats])
+		for benchmark in report:
+			print("Pruning ratio of %s: %s" % (benchmark["Name"], benchmark))
+		controller.call(s3.put_object,
+			Bucket=local_dataset_bucket,
+			Key="%s/%s/pruning_report.json" % (local_dataset_prefix, CLUSTERING_FOLDER),
+			Body=json.dumps(report).encode("utf8"),
+			ContentType="application/json"
 		)
 
-		cfnresponse.send(event, context, cfnresponse.SUCCESS, {})
-		
-	except ClientError as e:
+def delete_dataset(controller, properties):
+
+	local_dataset_bucket = properties["LocalDatasetBucket"]
+	local_dataset_prefix = properties["LocalDatasetPrefix"]
 
-		if e.response["Error"]["Code"] == "NoSuchKey":
-			# Object not found, nothing to do
-			cfnresponse.send(event, context, cfnresponse.SUCCESS, {})
+	keys = list_keys(controller, local_dataset_bucket, local_dataset_prefix + "/")
+	delete_keys(controller, local_dataset_bucket, keys)
+	print("Deleted %d objects under %s/" % (len(keys), local_dataset_prefix))
+
+def delete_keys(controller, bucket, keys):
+
+	batches = [keys[i:i + DELETE_BATCH_SIZE] for i in range(0, len(keys), DELETE_BATCH_SIZE)]
+
+	def delete_batch(batch):
+		response = s3.delete_objects(
+			Bucket=bucket,
+			Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True}
+		)
+		errors = response.get("Errors", [])
+		if errors:
+			# Per-key failures (including SlowDown) are surfaced so the controller can back off and retry.
+			raise ClientError({"Error": errors[0]}, "DeleteObjects")
+
+	controller.map(delete_batch, batches)
+
+def list_keys(controller, bucket, prefix):
+
+	keys = []
+	kwargs = {"Bucket": bucket, "Prefix": prefix}
+	while True:
+		response = controller.call(s3.list_objects_v2, **kwargs)
+		keys.extend(o["Key"] for o in response.get("Contents", []))
+		if not response.get("IsTruncated"):
+			return keys
+		kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+def copy_object(controller, source_bucket, source_key, bucket, key):
+
+	source = {"Bucket": source_bucket, "Key": source_key}
+	size = controller.call(s3.head_object, Bucket=source_bucket, Key=source_key)["ContentLength"]
+
+	if size <= PART_SIZE:
+		controller.call(s3.copy_object, CopySource=source, Bucket=bucket, Key=key)
+		return
+
+	# Parts are copied server side in parallel, with concurrency driven by the controller.
+	upload_id = controller.call(s3.create_multipart_upload, Bucket=bucket, Key=key)["UploadId"]
+
+	def copy_part(part_number):
+		first = (part_number - 1) * PART_SIZE
+		last = min(size, first + PART_SIZE) - 1
+		response = s3.upload_part_copy(
+			CopySource=source,
+			CopySourceRange="bytes=%d-%d" % (first, last),
+			Bucket=bucket,
+			Key=key,
+			PartNumber=part_number,
+			UploadId=upload_id
+		)
+		return {"ETag": response["CopyPartResult"]["ETag"], "PartNumber": part_number}
+
+	try:
+		parts = controller.map(copy_part, range(1, (size + PART_SIZE - 1) // PART_SIZE + 1))
+
+		controller.call(s3.complete_multipart_upload,
+			Bucket=bucket,
+			Key=key,
+			UploadId=upload_id,
+			MultipartUpload={"Parts": parts}
+		)
+
+	except Exception:
+		s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+		raise
+
+def scan_rows(controller, source_bucket, source_key, sidecars, consumers):
+
+	lines = iter_lines(open_source(s3, controller, source_bucket, source_key))
+	header = next(lines, b"")
+
+	for sidecar in sidecars:
+		sidecar.header(header)
+
+	for line in lines:
+		for consumer in consumers:
+			consumer.add(line)
+
+def put_sidecars(controller, bucket, prefix, key, sidecars):
+
+	for sidecar in sidecars:
+		controller.call(s3.put_object,
+			Bucket=bucket,
+			Key=sidecar_key(prefix, key, sidecar.kind),
+			Body=json.dumps(dict(sidecar.result(), Object=key)).encode("utf8"),
+			ContentType="application/json"
+		)
+
+def write_objects(controller, source_bucket, source_key, bucket, prefix, shard_prefixes, sidecar_factories, sample=None, consumers=(), cluster=None):
+
+	# Rows are streamed from the source into the local objects. With shards, there is one object
+	# per hashed shard prefix so request rate scales across N S3 prefixes, and rows are assigned
+	# round robin so every shard gets data whatever the number of rows written. Each object keeps
+	# the header row and the compression of the source, so it stays readable through Glue, and
+	# gets its sidecars (e.g. record index) written under the hidden _<kind>/ folders of the
+	# prefix. When a sample is given, only the rows it selects are written. When a clustering is
+	# given, rows are written in its order and each shard gets a contiguous range of about 1/N
+	# of them, so it covers a narrow range of the clustering columns. Consumers (e.g. rollups)
+	# see every row written.
+
+	object_name = source_key.split("/")[-1]
+	compress = is_gzip(source_key)
+	shards = max(1, len(shard_prefixes))
+
+	lines = iter_lines(open_source(s3, controller, source_bucket, source_key))
+	header = next(lines, b"")
+
+	if sample:
+		lines = sample(lines)
+
+	cluster_size = None
+	if cluster:
+		cluster_size, lines = cluster(lines)
+
+	def open_writer(n):
+		if shard_prefixes:
+			key = part_key("%s/%s" % (prefix, shard_prefixes[n]), object_name, n)
 		else:
-			print("Unexpected error: %s." % e)
-			cfnresponse.send(event, context, cfnresponse.FAILED, {})
\ No newline at end of file
+			key = prefix + "/" + object_name
+
+		# All the shards are written at once, so their buffers are kept to the minimum part size.
+		writer = ObjectWriter(s3, controller, bucket, key, compress=compress, part_size=MIN_PART_SIZE if shard_prefixes else WRITE_PART_SIZE)
+		writer.write(header)
+		sidecars = [factory() for factory in sidecar_factories]
+		for sidecar in sidecars:
+			sidecar.header(header)
+
+		return writer, sidecars
+
+	writers = [open_writer(n) for n in range(shards)]
+	closed = 0
+	written = 0
+
+	try:
+		for row, line in enumerate(lines):
+			if cluster_size:
+				writer, sidecars = writers[min(shards - 1, written * shards // cluster_size)]
+			else:
+				writer, sidecars = writers[row % shards]
+
+			writer.write(line)
+			written += len(line)
+			for sidecar in sidecars:
+				sidecar.add(line)
+			for consumer in consumers:
+				consumer.add(line)
+
+		for writer, sidecars in writers:
+			writer.close()
+			closed += 1
+			put_sidecars(controller, bucket, prefix, writer.key, sidecars)
+
+	except Exception:
+		for writer, _ in writers[closed:]:
+			writer.abort()
+		raise
+
+	print("Wrote %d objects under %s/" % (shards, prefix))
@@ -0,0 +1,182 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Shared helpers to stream text objects through the custom resources: the source
+# is read line by line (decompressing gzip on the fly), and output objects are
+# written with multipart uploads so memory stays bounded by the part size.
+
+import gzip
+import zlib
+
+READ_SIZE = 1024 * 1024
+WRITE_PART_SIZE = 8 * 1024 * 1024
+# Smallest size of a multipart upload part but the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+def is_gzip(key):
+
+	return key.endswith(".gz")
+
+def open_source(client, controller, bucket, key):
+
+	body = controller.call(client.get_object, Bucket=bucket, Key=key)["Body"]
+
+	if is_gzip(key):
+		return gzip.GzipFile(fileobj=body, mode="rb")
+
+	return body
+
+def iter_lines(stream, read_size=READ_SIZE):
+
+	# Yields each line with its line terminator, so byte offsets can be tracked by the caller.
+	pending = b""
+	while True:
+		chunk = stream.read(read_size)
+		if not chunk:
+			break
+
+		pending += chunk
+		start = 0
+		end = pending.find(b"\n", start)
+		while end != -1:
+			yield pending[start:end + 1]
+			start = end + 1
+			end = pending.find(b"\n", start)
+		pending = pending[start:]
+
+	if pending:
+		yield pending
+
+def part_key(prefix, object_name, part_number):
+
+	# e.g. green_tripdata_2020-06.csv -> <prefix>/green_tripdata_2020-06-00000.csv
+	stem, dot, suffix = object_name.partition(".")
+	return "%s/%s-%05d%s%s" % (prefix, stem, part_number, dot, suffix)
+
+def sidecar_key(prefix, key, kind):
+
+	# e.g. <prefix>/shard=c4ca-000/x-00000.csv -> <prefix>/_index/shard=c4ca-000/x-00000.csv.json
+	# Names starting with "_" are skipped by Hive and Athena when reading the table location.
+	return "%s/_%s/%s.json" % (prefix, kind, key[len(prefix) + 1:])
+
+class RecordIndex(object):
+
+	# Byte offsets of record boundaries roughly every chunk_size bytes of an uncompressed text
+	# object, so consumers can read it with parallel ranged GETs without splitting a row.
+	# Records are assumed to be single lines (no quoted line breaks).
+
+	kind = "index"
+
+	def __init__(self, chunk_size):
+
+		self.chunk_size = chunk_size
+		self.header_size = 0
+		self.size = 0
+		self.rows = 0
+		self.chunks = []
+
+	def header(self, line):
+
+		self.header_size = self.size = len(line)
+
+	def add(self, line):
+
+		if not self.chunks or self.size - self.chunks[-1]["Offset"] >= self.chunk_size:
+			self.chunks.append({"Offset": self.size, "Rows": 0})
+
+		self.chunks[-1]["Rows"] += 1
+		self.rows += 1
+		self.size += len(line)
+
+	def result(self):
+
+		for chunk, following in zip(self.chunks, self.chunks[1:] + [{"Offset": self.size}]):
+			chunk["Length"] = following["Offset"] - chunk["Offset"]
+
+		return {
+			"Size": self.size,
+			"HeaderSize": self.header_size,
+			"Rows": self.rows,
+			"ChunkSize": self.chunk_size,
+			"Chunks": self.chunks
+		}
+
+class ObjectWriter(object):
+
+	def __init__(self, client, controller, bucket, key, compress=False, part_size=WRITE_PART_SIZE):
+
+		self.client = client
+		self.controller = controller
+		self.bucket = bucket
+		self.key = key
+		self.part_size = part_size
+
+		self.bytes_in = 0
+		self.bytes_out = 0
+
+		self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+		self._buffer = bytearray()
+		self._parts = []
+		self._upload_id = None
+
+	def write(self, data):
+
+		self.bytes_in += len(data)
+		if self._compressor:
+			data = self._compressor.compress(data)
+
+		self._buffer += data
+		self.bytes_out += len(data)
+
+		if len(self._buffer) >= self.part_size:
+			self._upload_part()
+
+	def _upload_part(self):
+
+		if self._upload_id is None:
+			self._upload_id = self.controller.call(self.client.create_multipart_upload,
+				Bucket=self.bucket,
+				Key=self.key
+			)["UploadId"]
+
+		part_number = len(self._parts) + 1
+		response = self.controller.call(self.client.upload_part,
+			Bucket=self.bucket,
+			Key=self.key,
+			UploadId=self._upload_id,
+			PartNumber=part_number,
+			Body=bytes(self._buffer)
+		)
+
+		self._parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+		self._buffer = bytearray()
+
+	def close(self):
+
+		if self._compressor:
+			tail = self._compressor.flush()
+			self._buffer += tail
+			self.bytes_out += len(tail)
+
+		if self._upload_id is None:
+			self.controller.call(self.client.put_object,
+				Bucket=self.bucket,
+				Key=self.key,
+				Body=bytes(self._buffer)
+			)
+			return
+
+		if self._buffer:
+			self._upload_part()
+
+		self.controller.call(self.client.complete_multipart_upload,
+			Bucket=self.bucket,
+			Key=self.key,
+			UploadId=self._upload_id,
+			MultipartUpload={"Parts": self._parts}
+		)
+
+	def abort(self):
+
+		if self._upload_id is not None:
+			self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
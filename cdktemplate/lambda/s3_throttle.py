@@ -0,0 +1,239 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Shared AIMD (additive increase, multiplicative decrease) concurrency controller
+# for the S3 operations issued by the custom resources. In-flight requests grow
+# while latency stays under target and no throttling is observed, and are halved
+# (at most once per latency window) when S3 answers with SlowDown or similar.
+# Server errors and network timeouts are retried too, without changing concurrency.
+
+import json
+import random
+import threading
+import time
+from collections import deque
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+THROTTLE_CODES = (
+	"SlowDown",
+	"Throttling",
+	"ThrottlingException",
+	"RequestLimitExceeded",
+	"TooManyRequestsException",
+	"ServiceUnavailable",
+	"503"
+)
+
+# Transient errors that botocore would retry by itself
+RETRYABLE_CODES = (
+	"InternalError",
+	"RequestTimeout",
+	"RequestTimeoutException"
+)
+
+METRICS_NAMESPACE = "S3AccessPointCrossAccount"
+
+def client_config(max_concurrency):
+
+	# Retries are handled by the controller so that throttling is observed rather than hidden.
+	return Config(
+		retries = {"mode": "standard", "max_attempts": 1},
+		max_pool_connections = max_concurrency
+	)
+
+def is_throttle(e):
+
+	if not isinstance(e, ClientError):
+		return False
+
+	error = e.response.get("Error", {})
+	status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+
+	return error.get("Code") in THROTTLE_CODES or status == 503
+
+def is_retryable(e):
+
+	# Connection errors and read/connect timeouts are raised as BotoCoreError, not ClientError.
+	if isinstance(e, (ConnectionError, HTTPClientError)):
+		return True
+
+	if not isinstance(e, ClientError):
+		return False
+
+	error = e.response.get("Error", {})
+	status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+
+	return error.get("Code") in RETRYABLE_CODES or status >= 500
+
+class AimdController(object):
+
+	# Latency is tracked per operation (the name of the function called), and compared with the
+	# target of that operation in latency_targets, or latency_target: a 64 MB part copy takes
+	# longer than a HEAD without S3 being any more congested.
+
+	def __init__(self, name, initial=10, minimum=1, maximum=64, increase=1.0, decrease=0.5,
+			latency_target=2.0, latency_targets=None, max_attempts=8, base_backoff=0.1, clock=time.monotonic, sleep=time.sleep):
+
+		self.name = name
+		self.limit = float(initial)
+		self.minimum = minimum
+		self.maximum = maximum
+		self.increase = increase
+		self.decrease = decrease
+		self.latency_target = latency_target
+		self.latency_targets = latency_targets or {}
+		self.max_attempts = max_attempts
+		self.base_backoff = base_backoff
+		self.clock = clock
+		self.sleep = sleep
+
+		self.latency = None
+		self.latencies = {}
+		self.in_flight = 0
+		self.peak = self.limit
+		self.counters = {"Requests": 0, "Throttles": 0, "Errors": 0, "Increases": 0, "Decreases": 0, "Holds": 0}
+		self.decisions = []
+
+		self._last_decrease = None
+		self._cond = threading.Condition()
+
+	def acquire(self):
+
+		with self._cond:
+			while self.in_flight >= int(self.limit):
+				self._cond.wait()
+			self.in_flight += 1
+
+	def release(self):
+
+		with self._cond:
+			self.in_flight -= 1
+			self._cond.notify_all()
+
+	def on_success(self, latency, operation=None):
+
+		with self._cond:
+			self.counters["Requests"] += 1
+			previous = self.latencies.get(operation)
+			self.latency = self.latencies[operation] = latency if previous is None else 0.8 * previous + 0.2 * latency
+
+			latency_target = self.latency_targets.get(operation, self.latency_target)
+			if latency_target and self.latency > latency_target:
+				self.counters["Holds"] += 1
+				return
+
+			if self.limit < self.maximum:
+				# Roughly +increase per window of `limit` completed requests, as in TCP congestion avoidance.
+				previous = int(self.limit)
+				self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+				self.peak = max(self.peak, self.limit)
+				if int(self.limit) > previous:
+					self._record("increase")
+				self._cond.notify_all()
+
+	def on_throttle(self, operation=None, started=None):
+
+		with self._cond:
+			self.counters["Requests"] += 1
+			self.counters["Throttles"] += 1
+
+			now = self.clock()
+			window = self.latencies.get(operation) or self.base_backoff
+			if self._last_decrease is not None and (now - self._last_decrease < window or (started is not None and started < self._last_decrease)):
+				# Requests in flight during the same window, or sent before the last decrease, were
+				# throttled by the same congestion event.
+				return
+
+			self._last_decrease = now
+			self.limit = max(self.minimum, self.limit * self.decrease)
+			self._record("decrease")
+
+	def on_error(self):
+
+		with self._cond:
+			self.counters["Requests"] += 1
+			self.counters["Errors"] += 1
+
+	def _record(self, action):
+
+		self.counters["Increases" if action == "increase" else "Decreases"] += 1
+		decision = {"action": action, "limit": int(self.limit), "latency": self.latency}
+		self.decisions.append(decision)
+		print("%s concurrency %s: %s" % (self.name, action, decision))
+
+	def call(self, fn, *args, **kwargs):
+
+		operation = getattr(fn, "__name__", None)
+		attempt = 0
+		while True:
+			self.acquire()
+			start = self.clock()
+			try:
+				result = fn(*args, **kwargs)
+			except Exception as e:
+				self.release()
+				if is_throttle(e):
+					self.on_throttle(operation, start)
+				else:
+					self.on_error()
+					if not is_retryable(e):
+						raise
+				attempt += 1
+				if attempt >= self.max_attempts:
+					raise
+				# Full jitter backoff
+				self.sleep(random.uniform(0, self.base_backoff * (2 ** attempt)))
+				continue
+
+			self.release()
+			self.on_success(self.clock() - start, operation)
+			return result
+
+	def map(self, fn, items):
+
+		# Runs fn over items with at most `limit` calls in flight; results are returned in order.
+		items = list(items)
+		results = [None] * len(items)
+		pending = deque(enumerate(items))
+		errors = []
+		lock = threading.Lock()
+
+		def worker():
+			while True:
+				with lock:
+					if errors or not pending:
+						return
+					i, item = pending.popleft()
+				try:
+					results[i] = self.call(fn, item)
+				except Exception as e:
+					with lock:
+						errors.append(e)
+					return
+
+		workers = [threading.Thread(target=worker) for _ in range(min(self.maximum, len(items)))]
+		for w in workers:
+			w.start()
+		for w in workers:
+			w.join()
+
+		if errors:
+			raise errors[0]
+
+		return results
+
+	def emit_metrics(self, dimensions=None):
+
+		# CloudWatch Embedded Metric Format: the log line is turned into metrics without extra API calls.
+		dimensions = dict(dimensions or {}, Operation=self.name)
+		values = dict(self.counters, PeakConcurrency=int(self.peak), FinalConcurrency=int(self.limit))
+
+		print(json.dumps(dict(dimensions, _aws={
+			"Timestamp": int(time.time() * 1000),
+			"CloudWatchMetrics": [{
+				"Namespace": METRICS_NAMESPACE,
+				"Dimensions": [list(dimensions)],
+				"Metrics": [{"Name": k, "Unit": "Count"} for k in values]
+			}]
+		}, Decisions=self.decisions[-50:], **values)))
@@ -0,0 +1,82 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+
+# https://docs.aws.amazon.com/AmazonS3/latest/userguide/access-points-restrictions-limitations.html
+ACCESS_POINT_POLICY_MAX_SIZE = 20 * 1024
+
+# Values only known at deploy time are sized for their worst case: the access point ARN
+# (partition, region, account and a 50 character name) and the table prefix (a full S3 key).
+MAX_ACCESS_POINT_ARN = "arn:aws-us-gov:s3:us-gov-west-1:123456789012:accesspoint/" + "n" * 50
+MAX_TABLE_PREFIX = "p" * 1024
+
+def policy_size(groups):
+
+	# groups: [(vpc_ids, [role_arn, ...])]. Mirrors the statements of the access point policy in
+	# S3AccessPointFromTable: the roles of every group are allowed to read the table, and denied
+	# any request that does not come from one of the VPCs of their group.
+	principals = {"AWS": [role_arn for _, role_arns in groups for role_arn in role_arns]}
+	statements = [
+		{
+			"Effect": "Allow",
+			"Principal": principals,
+			"Action": "s3:GetObject*",
+			"Resource": "%s/object/%s*" % (MAX_ACCESS_POINT_ARN, MAX_TABLE_PREFIX)
+		},
+		{
+			"Effect": "Allow",
+			"Principal": principals,
+			"Action": "s3:ListBucket*",
+			"Resource": MAX_ACCESS_POINT_ARN,
+			"Condition": {"StringLike": {"s3:prefix": "%s*" % MAX_TABLE_PREFIX}}
+		}
+	]
+	for vpc_ids, role_arns in groups:
+		statements.append({
+			"Effect": "Deny",
+			"Principal": {"AWS": list(role_arns)},
+			"Action": "s3:*",
+			"Resource": [MAX_ACCESS_POINT_ARN, "%s/object/*" % MAX_ACCESS_POINT_ARN],
+			"Condition": {"StringNotEquals": {"aws:SourceVpc": list(vpc_ids)}}
+		})
+
+	policy = {"Version": "2012-10-17", "Statement": statements}
+
+	return len(json.dumps(policy, separators=(",", ":")))
+
+def pack_grantees(grantees, max_size=ACCESS_POINT_POLICY_MAX_SIZE):
+
+	# Access points are not bound to a VPC: the VPCs of each role are enforced by its policy, so
+	# grantees of any VPC and account share access points. Roles are grouped by their set of VPCs
+	# (one Deny statement each) and packed first-fit decreasing into as few policies as the size
+	# limit allows. Returns a list of [(vpc_ids, [role_arn, ...]), ...], one entry per access point.
+
+	vpcs_by_role = {}
+	for grantee in grantees:
+		vpc_ids = vpcs_by_role.setdefault(grantee["RoleArn"], [])
+		if grantee["VpcId"] not in vpc_ids:
+			vpc_ids.append(grantee["VpcId"])
+
+	roles_by_vpcs = {}
+	for role_arn, vpc_ids in vpcs_by_role.items():
+		roles_by_vpcs.setdefault(tuple(sorted(vpc_ids)), []).append(role_arn)
+
+	def with_role(b, vpc_ids, role_arn):
+		return [(v, roles + [role_arn] if v == vpc_ids else roles) for v, roles in b] + ([] if vpc_ids in dict(b) else [(vpc_ids, [role_arn])])
+
+	bins = []
+
+	for vpc_ids in sorted(roles_by_vpcs, key=lambda v: (-len(roles_by_vpcs[v]), v)):
+		for role_arn in sorted(roles_by_vpcs[vpc_ids], key=len, reverse=True):
+			if policy_size(with_role([], vpc_ids, role_arn)) > max_size:
+				raise ValueError("IAM Role ARN %s does not fit in an access point policy." % role_arn)
+
+			for n, b in enumerate(bins):
+				if policy_size(with_role(b, vpc_ids, role_arn)) <= max_size:
+					bins[n] = with_role(b, vpc_ids, role_arn)
+					break
+			else:
+				bins.append(with_role([], vpc_ids, role_arn))
+
+	return [sorted((vpc_ids, sorted(role_arns)) for vpc_ids, role_arns in b) for b in bins]
@@ -11,8 +11,55 @@ from aws_cdk import (
 )
 import os
 
+from stacks.clustering import clustering_spec
+from stacks.dataset_layout import partition_value, shard_prefixes, SHARD_PARTITION_KEY
+from stacks.rollups import rollup_spec, rollup_table
+
 BUCKET_ARN = os.environ["AMAZON_REVIEWS_BUCKET_ARN"]
 OBJECT = os.environ["AMAZON_REVIEWS_OBJECT"]
+SHARDS = int(os.environ.get("AMAZON_REVIEWS_SHARDS", "1"))
+INDEX_MB = int(os.environ.get("AMAZON_REVIEWS_INDEX_MB", "0"))
+ENABLED_ROLLUPS = [name for name in os.environ.get("AMAZON_REVIEWS_ROLLUPS", "").split(",") if name]
+BLOOM_FILTER_COLUMNS = [name for name in os.environ.get("AMAZON_REVIEWS_BLOOM_FILTER_COLUMNS", "").split(",") if name]
+CLUSTER_COLUMNS = [name for name in os.environ.get("AMAZON_REVIEWS_CLUSTER_COLUMNS", "").split(",") if name]
+CLUSTER_ORDER = os.environ.get("AMAZON_REVIEWS_CLUSTER_ORDER", "sort")
+
+COLUMNS = [
+	{"name": "marketplace", "type": "string"},
+	{"name": "customer_id", "type": "string"},
+	{"name": "review_id","type": "string"},
+	{"name": "product_id","type": "string"},
+	{"name": "product_parent","type": "string"},
+	{"name": "product_title","type": "string"},
+	{"name": "product_category","type": "string"},
+	{"name": "star_rating","type": "int"},
+	{"name": "helpful_votes","type": "int"},
+	{"name": "total_votes","type": "int"},
+	{"name": "vine","type": "string"},
+	{"name": "verified_purchase","type": "string"},
+	{"name": "review_headline","type": "string"},
+	{"name": "review_body","type": "string"},
+	{"name": "review_date","type": "string"}]
+
+# Rollups that can be computed while the dataset is loaded, and registered as <table>_<name>
+ROLLUPS = [
+	{
+		"Name": "product_ratings",
+		"GroupBy": [
+			{"Column": "product_id"},
+			{"Column": "star_rating"}
+		],
+		"Aggregates": [
+			{"Function": "count", "As": "reviews"}
+		]
+	}
+]
+
+# Range queries on which the pruning ratio of a clustered load is reported
+BENCHMARKS = [
+	{"Name": "product_range", "Column": "product_id", "Min": "B00E", "Max": "B00EZZZZZZ"},
+	{"Name": "one_star", "Column": "star_rating", "Min": "1", "Max": "1"}
+]
 
 class AmazonReviewsDatasetStack(core.Stack):
 
@@ -35,6 +82,27 @@ class AmazonReviewsDatasetStack(core.Stack):
 				default = "amazon_reviews_table"
 			)
 
+		sample_fraction = core.CfnParameter(self, "SampleFractionAmazonReviews", 
+				type="Number",
+				description="Fraction of the rows of Amazon Reviews to be loaded, e.g. 0.01 for dev and test environments.",
+				min_value = 0,
+				max_value = 1,
+				default = 1
+			)
+
+		sample_rows = core.CfnParameter(self, "SampleRowsAmazonReviews", 
+				type="Number",
+				description="If greater than 0, a fixed number of rows of Amazon Reviews to be loaded instead of a fraction.",
+				min_value = 0,
+				default = 0
+			)
+
+		sample_seed = core.CfnParameter(self, "SampleSeedAmazonReviews", 
+				type="String",
+				description="Seed for the sample. Rows are selected from a hash of their content and the seed, so a seed always yields the same sample.",
+				default = "0"
+			)
+
 		self.template_options.description = "\
 This template deploys the dataset containing Amazon Customer Reviews (a.k.a. Product Reviews).\n \
 Sample data is copied from the public dataset into a local S3 bucket, a database and table are created in AWS Glue, \
@@ -57,8 +125,20 @@ and the S3 location is registered with AWS Lake Formation."
 
 		public_dataset_bucket = s3.Bucket.from_bucket_arn(self, "PublicDatasetBucket", BUCKET_ARN)
 
-		with open("lambda/s3_copy.py", encoding="utf8") as fp:
-			s3_copy_code = fp.read()
+		local_dataset_shard_prefixes = shard_prefixes(SHARDS)
+
+		unknown_rollups = set(ENABLED_ROLLUPS) - set(r["Name"] for r in ROLLUPS)
+		if unknown_rollups:
+			raise ValueError("Unknown rollups: %s" % sorted(unknown_rollups))
+
+		local_dataset_rollups = [r for r in ROLLUPS if r["Name"] in ENABLED_ROLLUPS]
+
+		column_names = [c["name"] for c in COLUMNS]
+		unknown_columns = set(BLOOM_FILTER_COLUMNS) - set(column_names)
+		if unknown_columns:
+			raise ValueError("Unknown Bloom filter columns: %s" % sorted(unknown_columns))
+
+		local_dataset_bloom_filter_columns = [{"Column": name, "Index": column_names.index(name)} for name in BLOOM_FILTER_COLUMNS]
 
 		s3_copy_execution_role = iam.Role(self, "S3CopyHandlerServiceRole",
 			assumed_by = iam.ServicePrincipal('lambda.amazonaws.com'),
@@ -81,9 +161,17 @@ and the S3 location is registered with AWS Lake Formation."
 						actions=[
 							"s3:PutObject",
 							"s3:GetObject",
-							"s3:DeleteObject"
+							"s3:DeleteObject",
+							"s3:AbortMultipartUpload"
 						],
 						resources=[local_dataset_bucket.arn_for_objects("*")]
+						),
+					iam.PolicyStatement(
+						effect=iam.Effect.ALLOW,
+						actions=[
+							"s3:ListBucket"
+						],
+						resources=[local_dataset_bucket.bucket_arn]
 						)
 					]
 				) }
@@ -91,10 +179,12 @@ and the S3 location is registered with AWS Lake Formation."
 
 		s3_copy_fn = _lambda.Function(self, "S3CopyHandler", 
 			runtime = _lambda.Runtime.PYTHON_3_7,
-			code = _lambda.InlineCode.from_inline(s3_copy_code),
-			handler = "index.handler",
+			# The load function and its modules exceed the 4 KB of inline code, the lambda folder is an asset
+			code = _lambda.Code.from_asset("lambda", exclude=["__pycache__"]),
+			handler = "s3_copy.handler",
 			role =  s3_copy_execution_role,
-			timeout = core.Duration.seconds(600)
+			memory_size = 1024,
+			timeout = core.Duration.seconds(900)
 		)
 
 		s3_copy = core.CustomResource(self, "S3Copy", 
@@ -104,7 +194,16 @@ and the S3 location is registered with AWS Lake Formation."
 				"PublicDatasetBucket": public_dataset_bucket.bucket_name,
 				"LocalDatasetBucket" : local_dataset_bucket.bucket_name,
 				"PublicDatasetObject": OBJECT,
-				"LocalDatasetPrefix": glue_table_name.value_as_string
+				"LocalDatasetPrefix": glue_table_name.value_as_string,
+				"LocalDatasetShardPrefixes": local_dataset_shard_prefixes,
+				"LocalDatasetIndexChunkSize": str(INDEX_MB * 1024 * 1024),
+				"LocalDatasetSampleFraction": sample_fraction.value_as_string,
+				"LocalDatasetSampleRows": sample_rows.value_as_string,
+				"LocalDatasetSampleSeed": sample_seed.value_as_string,
+				"LocalDatasetDelimiter": "\t",
+				"LocalDatasetRollups": [rollup_spec(r, COLUMNS) for r in local_dataset_rollups],
+				"LocalDatasetBloomFilterColumns": local_dataset_bloom_filter_columns,
+				"LocalDatasetClustering": clustering_spec(CLUSTER_COLUMNS, CLUSTER_ORDER, BENCHMARKS, COLUMNS)
 			} 
 		)	
 
@@ -124,6 +223,23 @@ and the S3 location is registered with AWS Lake Formation."
 			)
 		)
 
+		table_location = local_dataset_bucket.s3_url_for_object() + "/" + glue_table_name.value_as_string + "/"
+
+		def storage_descriptor(cfn_type, location):
+			return cfn_type.StorageDescriptorProperty(
+				columns = COLUMNS,
+				location = location,
+				input_format = "org.apache.hadoop.mapred.TextInputFormat",
+				output_format = "org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat",
+				compressed = True,
+				serde_info = cfn_type.SerdeInfoProperty( 
+					serialization_library = "org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe",
+					parameters = {
+						"field.delim": "\t"
+					}
+				)
+			)
+
 		amazon_reviews_table = glue.CfnTable(self, "GlueTableAmazonReviews", 
 			catalog_id = cfn_glue_db.catalog_id,
 			database_name = glue_db_name.value_as_string,
@@ -137,40 +253,35 @@ and the S3 location is registered with AWS Lake Formation."
 					"delimiter": "\t",
 					"typeOfData": "file"
 				},
-				storage_descriptor = glue.CfnTable.StorageDescriptorProperty(
-					columns = [
-						{"name": "marketplace", "type": "string"},
-						{"name": "customer_id", "type": "string"},
-						{"name": "review_id","type": "string"},
-						{"name": "product_id","type": "string"},
-						{"name": "product_parent","type": "string"},
-						{"name": "product_title","type": "string"},
-						{"name": "product_category","type": "string"},
-						{"name": "star_rating","type": "int"},
-						{"name": "helpful_votes","type": "int"},
-						{"name": "total_votes","type": "int"},
-						{"name": "vine","type": "string"},
-						{"name": "verified_purchase","type": "string"},
-						{"name": "review_headline","type": "string"},
-						{"name": "review_body","type": "string"},
-						{"name": "review_date","type": "string"}],
-					location = local_dataset_bucket.s3_url_for_object() + "/" + glue_table_name.value_as_string + "/",
-					input_format = "org.apache.hadoop.mapred.TextInputFormat",
-					output_format = "org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat",
-					compressed = True,
-					serde_info = glue.CfnTable.SerdeInfoProperty( 
-						serialization_library = "org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe",
-						parameters = {
-							"field.delim": "\t"
-						}
-					)
-				),
+				storage_descriptor = storage_descriptor(glue.CfnTable, table_location),
+				partition_keys = [{"name": SHARD_PARTITION_KEY, "type": "string"}] if local_dataset_shard_prefixes else None,
 				table_type = "EXTERNAL_TABLE"
 			)
 		)
 
 		amazon_reviews_table.node.add_dependency(cfn_glue_db)
 
+		for i, shard_prefix in enumerate(local_dataset_shard_prefixes):
+			partition = glue.CfnPartition(self, "GlueTablePartitionAmazonReviews%d" % i,
+				catalog_id = cfn_glue_db.catalog_id,
+				database_name = glue_db_name.value_as_string,
+				table_name = glue_table_name.value_as_string,
+				partition_input = glue.CfnPartition.PartitionInputProperty(
+					values = [partition_value(shard_prefix)],
+					storage_descriptor = storage_descriptor(glue.CfnPartition, table_location + shard_prefix + "/")
+				)
+			)
+
+			partition.node.add_dependency(amazon_reviews_table)
+
+		for rollup in local_dataset_rollups:
+			rollup_glue_table = rollup_table(self, "GlueTableRollupAmazonReviews%s" % rollup["Name"].title().replace("_", ""),
+				cfn_glue_db, glue_db_name.value_as_string, glue_table_name.value_as_string, table_location, rollup, COLUMNS)
+
+			core.CfnOutput(self, "GlueTableRollupAmazonReviews%sOutput" % rollup["Name"].title().replace("_", ""), 
+				value=rollup_glue_table.ref, 
+				description="Glue Table created to host the %s rollup of the dataset" % rollup["Name"])
+
 		core.CfnOutput(self, "LocalAmazonReviewsBucketOutput", 
 			value=local_dataset_bucket.bucket_name, 
 			description="S3 Bucket created to store the dataset")
@@ -0,0 +1,36 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+CLUSTERING_ORDERS = ("sort", "zorder")
+NUMBER_TYPES = ("tinyint", "smallint", "int", "integer", "bigint", "float", "double")
+
+def clustering_spec(cluster_columns, order, benchmarks, columns):
+
+	# Resolves column names to positions and comparison types in the source rows, as expected by
+	# lambda/row_cluster.py. Only the benchmarks on clustering columns can be reported.
+
+	if not cluster_columns:
+		return {}
+
+	if order not in CLUSTERING_ORDERS:
+		raise ValueError("Unknown clustering order: %s" % order)
+
+	names = [c["name"] for c in columns]
+	types = dict((c["name"], c["type"]) for c in columns)
+
+	unknown_columns = set(cluster_columns) - set(names)
+	if unknown_columns:
+		raise ValueError("Unknown clustering columns: %s" % sorted(unknown_columns))
+
+	return {
+		"Order": order,
+		"Columns": [
+			{
+				"Column": name,
+				"Index": names.index(name),
+				"Type": "number" if types[name] in NUMBER_TYPES or types[name].startswith("decimal") else "string"
+			}
+			for name in cluster_columns
+		],
+		"Benchmarks": [b for b in benchmarks if b["Column"] in cluster_columns]
+	}
@@ -0,0 +1,28 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import hashlib
+
+SHARD_PARTITION_KEY = "shard"
+# Shards are written at once by the load function, each with a 5 MB upload buffer
+MAX_SHARDS = 64
+
+def shard_prefixes(shards):
+
+	# S3 scales request rate per prefix, so a sharded dataset is spread across N sub-prefixes
+	# whose names start with a hash (e.g. shard=c4ca-000), each registered as a Glue partition.
+
+	if shards < 1 or shards > MAX_SHARDS:
+		raise ValueError("Number of shards must be between 1 and %d, got %d." % (MAX_SHARDS, shards))
+
+	if shards == 1:
+		return []
+
+	return [
+		"%s=%s-%03d" % (SHARD_PARTITION_KEY, hashlib.md5(str(i).encode("utf8")).hexdigest()[:4], i)
+		for i in range(shards)
+	]
+
+def partition_value(prefix):
+
+	return prefix.split("=", 1)[1]
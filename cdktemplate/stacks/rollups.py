@@ -0,0 +1,83 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+from aws_cdk import (
+	aws_glue as glue
+)
+
+# Rollups are stored under the hidden _rollups/ folder of the dataset prefix: they are skipped
+# when reading the base table, and shared along with it by S3AccessPointFromTable.
+ROLLUP_FOLDER = "_rollups"
+
+def rollup_key(rollup):
+
+	return "%s/%s/%s.csv" % (ROLLUP_FOLDER, rollup["Name"], rollup["Name"])
+
+def rollup_columns(rollup, columns):
+
+	types = dict((c["name"], c["type"]) for c in columns)
+
+	group_by = [
+		{"name": g.get("As", g["Column"]), "type": "string" if g.get("Length") else types[g["Column"]]}
+		for g in rollup["GroupBy"]
+	]
+	aggregates = [
+		{"name": a["As"], "type": "bigint" if a["Function"] == "count" else "double"}
+		for a in rollup["Aggregates"]
+	]
+
+	return group_by + aggregates
+
+def rollup_spec(rollup, columns):
+
+	# Resolves column names to positions in the source rows, as expected by lambda/row_rollup.py
+
+	names = [c["name"] for c in columns]
+
+	for a in rollup["Aggregates"]:
+		if a["Function"] not in ("count", "sum"):
+			raise ValueError("Unsupported aggregate function in rollup %s: %s" % (rollup["Name"], a["Function"]))
+
+	return {
+		"Key": rollup_key(rollup),
+		"Columns": [c["name"] for c in rollup_columns(rollup, columns)],
+		"GroupBy": [dict({"Index": names.index(g["Column"])}, **({"Length": g["Length"]} if g.get("Length") else {})) for g in rollup["GroupBy"]],
+		"Aggregates": [dict({"Function": a["Function"]}, **({"Index": names.index(a["Column"])} if "Column" in a else {})) for a in rollup["Aggregates"]]
+	}
+
+def rollup_table(scope, id, cfn_glue_db, glue_db_name, glue_table_name, table_location, rollup, columns):
+
+	table = glue.CfnTable(scope, id,
+		catalog_id = cfn_glue_db.catalog_id,
+		database_name = glue_db_name,
+		table_input = glue.CfnTable.TableInputProperty(
+			description = "Rollup %s of %s, computed when the dataset is loaded" % (rollup["Name"], glue_table_name),
+			name = f"{glue_table_name}_{rollup['Name']}",
+			parameters = {
+				"skip.header.line.count": "1",
+				"compressionType": "none",
+				"classification": "csv",
+				"delimiter": ",",
+				"typeOfData": "file"
+			},
+			storage_descriptor = glue.CfnTable.StorageDescriptorProperty(
+				columns = rollup_columns(rollup, columns),
+				location = table_location + ROLLUP_FOLDER + "/" + rollup["Name"] + "/",
+				input_format = "org.apache.hadoop.mapred.TextInputFormat",
+				output_format = "org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat",
+				compressed = False,
+				serde_info = glue.CfnTable.SerdeInfoProperty(
+					serialization_library = "org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe",
+					parameters = {
+						"field.delim": ",",
+						"escape.delim": "\\"
+					}
+				)
+			),
+			table_type = "EXTERNAL_TABLE"
+		)
+	)
+
+	table.node.add_dependency(cfn_glue_db)
+
+	return table
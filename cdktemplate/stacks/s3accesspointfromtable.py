@@ -11,12 +11,31 @@ from aws_cdk import (
 	core
 )
 import os
+import re
+
+from stacks.accesspoint_packing import pack_grantees
+
+ROLE_ARN_PATTERN = "arn:(aws[a-zA-Z-]*)?:iam::\d{12}:role\/?[a-zA-Z0-9_+=,.@\-]+"
+VPC_PATTERN = "vpc-[a-zA-Z0-9]+"
+
+# A template has at most 500 resources, the other resources of the stack are a handful
+MAX_GRANTEE_ACCESS_POINTS = 480
 
 class S3AccessPointFromTable(core.Stack):
 
-	def __init__(self, scope: core.Construct, id: str, **kwargs) -> None:
+	# grantees: optional list of {"RoleArn": ..., "VpcId": ...}. When given, the GranteeIAMRoleARN
+	# and GranteeVPC parameters are replaced by access points shared by all the grantees.
+
+	def __init__(self, scope: core.Construct, id: str, grantees: list = None, **kwargs) -> None:
 		super().__init__(scope, id, **kwargs)
 
+		if grantees is not None and not grantees:
+			raise ValueError("The list of grantees is empty, no access point would be created.")
+
+		for grantee in grantees or []:
+			if not re.fullmatch(ROLE_ARN_PATTERN, grantee["RoleArn"]) or not re.fullmatch(VPC_PATTERN, grantee["VpcId"]):
+				raise ValueError("Invalid grantee: %s" % grantee)
+
 	# CloudFormation Parameters
 
 		glue_db_name = core.CfnParameter(self, "GlueDatabaseName", 
@@ -31,17 +50,18 @@ class S3AccessPointFromTable(core.Stack):
 				allowed_pattern="[\w-]+",
 			)
 
-		grantee_role_arn = core.CfnParameter(self, "GranteeIAMRoleARN", 
-				type="String",
-				description="IAM Role's ARN.",
-				allowed_pattern="arn:(aws[a-zA-Z-]*)?:iam::\d{12}:role\/?[a-zA-Z0-9_+=,.@\-]+"
-			)
-		
-		grantee_vpc = core.CfnParameter(self, "GranteeVPC", 
-				type="String",
-				description="VPC ID from where the S3 access point will be accessed.",
-				allowed_pattern="vpc-[a-zA-Z0-9]+"
-			)
+		if grantees is None:
+			grantee_role_arn = core.CfnParameter(self, "GranteeIAMRoleARN", 
+					type="String",
+					description="IAM Role's ARN.",
+					allowed_pattern=ROLE_ARN_PATTERN
+				)
+			
+			grantee_vpc = core.CfnParameter(self, "GranteeVPC", 
+					type="String",
+					description="VPC ID from where the S3 access point will be accessed.",
+					allowed_pattern=VPC_PATTERN
+				)
 
 		is_lakeformation = core.CfnParameter(self, "LakeFormationParam", 
 				type="String",
@@ -60,41 +80,49 @@ access to the underlying data location for a given Glue Table.\n\
 Main use case for this template is to grant an ETL process in another AWS Account, \
 access to the S3 objects (e.g., Parquet files) associated to a Glue Table."
 
-		self.template_options.metadata = {
-		
-		"AWS::CloudFormation::Interface": {
-			"License": "MIT-0",
-			"ParameterGroups": [
-				{
-					"Label": { "default": "Lake Formation (Producer Account)" },
-					"Parameters": [ is_lakeformation.logical_id ]
-				},
-				{
-					"Label": { "default": "Source Data Catalog Resource (Producer Account)" },
-					"Parameters": [ glue_db_name.logical_id, glue_table_name.logical_id ]
-				},
-				{
-					"Label": { "default": "Grantee IAM Role (Consumer Account)" },
-					"Parameters": [ grantee_role_arn.logical_id, grantee_vpc.logical_id ]
-				}
-			],
-			"ParameterLabels": {
-				is_lakeformation.logical_id: {
-					"default": "Are data permissions managed by Lake Formation?"
-				},
-				glue_db_name.logical_id: {
-					"default": "What is the Glue DB Name for the Table?"
-				},
-				glue_table_name.logical_id: {
-					"default": "What is the Glue Table Name?"
-				},
+		parameter_groups = [
+			{
+				"Label": { "default": "Lake Formation (Producer Account)" },
+				"Parameters": [ is_lakeformation.logical_id ]
+			},
+			{
+				"Label": { "default": "Source Data Catalog Resource (Producer Account)" },
+				"Parameters": [ glue_db_name.logical_id, glue_table_name.logical_id ]
+			},
+		]
+		parameter_labels = {
+			is_lakeformation.logical_id: {
+				"default": "Are data permissions managed by Lake Formation?"
+			},
+			glue_db_name.logical_id: {
+				"default": "What is the Glue DB Name for the Table?"
+			},
+			glue_table_name.logical_id: {
+				"default": "What is the Glue Table Name?"
+			}
+		}
+
+		if grantees is None:
+			parameter_groups.append({
+				"Label": { "default": "Grantee IAM Role (Consumer Account)" },
+				"Parameters": [ grantee_role_arn.logical_id, grantee_vpc.logical_id ]
+			})
+			parameter_labels.update({
 				grantee_role_arn.logical_id: {
 					"default": "What is the ARN of the IAM Role?"
 				},
 				grantee_vpc.logical_id: {
 					"default": "What VPC will be used to access the S3 Access Point?"
 				}
-			}
+			})
+
+		# template_options.metadata returns a copy, it must be assigned as a whole
+		self.template_options.metadata = {
+		
+		"AWS::CloudFormation::Interface": {
+			"License": "MIT-0",
+			"ParameterGroups": parameter_groups,
+			"ParameterLabels": parameter_labels
 		} }
 
 		is_lakeformation_condition = core.CfnCondition(self, "IsLakeFormation", 
@@ -103,7 +131,8 @@ access to the S3 objects (e.g., Parquet files) associated to a Glue Table."
 
 	# Create S3 Access Point to share dataset objects
 
-		grantee_role = iam.Role.from_role_arn(self, "GranteeIAMRole", grantee_role_arn.value_as_string)
+		if grantees is None:
+			grantee_role = iam.Role.from_role_arn(self, "GranteeIAMRole", grantee_role_arn.value_as_string)
 		
 		glue_table_arn = f"arn:aws:glue:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:table/{glue_db_name.value_as_string}/{glue_table_name.value_as_string}"
 
@@ -168,67 +197,120 @@ access to the S3 objects (e.g., Parquet files) associated to a Glue Table."
 		table_name_normalized = core.Fn.join("-", core.Fn.split("_", glue_table_name.value_as_string))
 		random_suffix = core.Fn.select(0, core.Fn.split("-", core.Fn.select(2, core.Fn.split("/", core.Aws.STACK_ID))))
 
-		s3_accesspoint_name = f"{table_name_normalized}-{random_suffix}"
-
-		s3_accesspoint_arn = f"arn:aws:s3:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:accesspoint/{s3_accesspoint_name}"
-
-		glue_table_accesspoint_path = f"{s3_accesspoint_arn}/object/{table_prefix}"
-
-		# s3_accesspoint_block_config = s3.CfnAccessPoint.PublicAccessBlockConfigurationProperty(block_public_acls=True, block_public_policy=True, ignore_public_acls=True, restrict_public_buckets=True)
-
-		s3_accesspoint_policy = iam.PolicyDocument( 
-				statements = [
-					iam.PolicyStatement(
-						effect=iam.Effect.ALLOW,
-						principals = [
-							iam.ArnPrincipal(arn = grantee_role.role_arn)
-						],
-						actions=[
-							"s3:GetObject*"
-						],
-						resources=[
-							f"{glue_table_accesspoint_path}*"
-						]),
-					iam.PolicyStatement(
-						effect=iam.Effect.ALLOW,
-						principals = [
-							iam.ArnPrincipal(arn = grantee_role.role_arn)
-						],
-						actions=[
-							"s3:ListBucket*"
-						],
-						resources=[s3_accesspoint_arn],
-						conditions = {
-             				"StringLike" : {
-                 				"s3:prefix": f"{table_prefix}*"
+		def create_accesspoint(construct_id, s3_accesspoint_name, role_arns, vpc_id=None, vpc_groups=()):
+
+			s3_accesspoint_arn = f"arn:aws:s3:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:accesspoint/{s3_accesspoint_name}"
+
+			glue_table_accesspoint_path = f"{s3_accesspoint_arn}/object/{table_prefix}"
+
+			# s3_accesspoint_block_config = s3.CfnAccessPoint.PublicAccessBlockConfigurationProperty(block_public_acls=True, block_public_policy=True, ignore_public_acls=True, restrict_public_buckets=True)
+
+			# Statements must be kept in sync with policy_size() in accesspoint_packing.py
+			s3_accesspoint_policy = iam.PolicyDocument( 
+					statements = [
+						iam.PolicyStatement(
+							effect=iam.Effect.ALLOW,
+							principals = [iam.ArnPrincipal(arn = role_arn) for role_arn in role_arns],
+							actions=[
+								"s3:GetObject*"
+							],
+							resources=[
+								f"{glue_table_accesspoint_path}*"
+							]),
+						iam.PolicyStatement(
+							effect=iam.Effect.ALLOW,
+							principals = [iam.ArnPrincipal(arn = role_arn) for role_arn in role_arns],
+							actions=[
+								"s3:ListBucket*"
+							],
+							resources=[s3_accesspoint_arn],
+							conditions = {
+								"StringLike" : {
+									"s3:prefix": f"{table_prefix}*"
+								}
 							}
-						}
-					)
-				]
-			)
+						)
+					] + [
+						# Roles shared by many VPCs are only allowed from their own
+						iam.PolicyStatement(
+							effect=iam.Effect.DENY,
+							principals = [iam.ArnPrincipal(arn = role_arn) for role_arn in group_role_arns],
+							actions=[
+								"s3:*"
+							],
+							resources=[s3_accesspoint_arn, f"{s3_accesspoint_arn}/object/*"],
+							conditions = {
+								"StringNotEquals" : {
+									"aws:SourceVpc": list(vpc_ids)
+								}
+							}
+						)
+						for vpc_ids, group_role_arns in vpc_groups
+					]
+				)
 
-		s3_accesspoint = s3.CfnAccessPoint(self, "S3AccessPoint", 
-			bucket = f"{table_bucket}",
-			name = s3_accesspoint_name,
-			# network_origin = "Internet",
-			policy = s3_accesspoint_policy,
-			vpc_configuration = s3.CfnAccessPoint.VpcConfigurationProperty(
-				vpc_id = grantee_vpc.value_as_string
+			s3_accesspoint = s3.CfnAccessPoint(self, construct_id, 
+				bucket = f"{table_bucket}",
+				name = s3_accesspoint_name,
+				# network_origin = "Internet",
+				policy = s3_accesspoint_policy,
+				vpc_configuration = s3.CfnAccessPoint.VpcConfigurationProperty(
+					vpc_id = vpc_id
+				) if vpc_id else None
 			)
-		)
 
-		glue_table_accesspoint_path_output = f"arn:aws:s3:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:accesspoint/{s3_accesspoint.name}/object/{table_prefix}"
+			return s3_accesspoint, f"arn:aws:s3:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:accesspoint/{s3_accesspoint.name}/object/{table_prefix}"
+
+		if grantees is None:
+			s3_accesspoint, glue_table_accesspoint_path_output = create_accesspoint("S3AccessPoint",
+				f"{table_name_normalized}-{random_suffix}", [grantee_role.role_arn], grantee_vpc.value_as_string)
+
+		else:
+			# Grantees of every VPC are packed into as few access points as the policy size limit
+			# allows, each role in exactly one of them.
+			packed = pack_grantees(grantees)
+			if len(packed) > MAX_GRANTEE_ACCESS_POINTS:
+				raise ValueError("%d access points are needed for the grantees, at most %d fit in a template." % (len(packed), MAX_GRANTEE_ACCESS_POINTS))
+
+			grantee_accesspoint_lookup = {"AccessPoints": [], "Grantees": {}}
+			for i, vpc_groups in enumerate(packed):
+				role_arns = [role_arn for _, group_role_arns in vpc_groups for role_arn in group_role_arns]
+				s3_accesspoint, _ = create_accesspoint(f"S3AccessPoint{i}",
+					f"{table_name_normalized}-{random_suffix}-{i}", role_arns, vpc_groups=vpc_groups)
+
+				grantee_accesspoint_lookup["AccessPoints"].append({
+					"Name": s3_accesspoint.name,
+					"Alias": core.Fn.get_att(s3_accesspoint.logical_id, "Alias").to_string()
+				})
+				for role_arn in role_arns:
+					grantee_accesspoint_lookup["Grantees"][role_arn] = i
 
 	# Output
 
-		core.CfnOutput(self, "IAMRoleArnOutput", 
-			value=grantee_role.role_arn, 
-			description="IAM Role Arn")
+		if grantees is None:
+			core.CfnOutput(self, "IAMRoleArnOutput", 
+				value=grantee_role.role_arn, 
+				description="IAM Role Arn")
 
 		core.CfnOutput(self, "GlueTableOutput", 
 			value=glue_table.table_arn, 
 			description="Glue Table ARN")
 
-		core.CfnOutput(self, "S3AccessPointPathOutput", 
-			value=glue_table_accesspoint_path_output, 
-			description="S3 Access Point Path for Glue Table")
\ No newline at end of file
+		if grantees is None:
+			core.CfnOutput(self, "S3AccessPointPathOutput", 
+				value=glue_table_accesspoint_path_output, 
+				description="S3 Access Point Path for Glue Table")
+
+			core.CfnOutput(self, "S3AccessPointAliasOutput", 
+				value=core.Fn.get_att(s3_accesspoint.logical_id, "Alias").to_string(), 
+				description="S3 Access Point Alias, usable as a bucket name (e.g. by DuckDB)")
+
+		else:
+			# A fixed number of outputs, whatever the number of grantees and access points
+			core.CfnOutput(self, "GranteeAccessPointLookupOutput", 
+				value=self.to_json_string(grantee_accesspoint_lookup), 
+				description="S3 Access Points (Name, and Alias usable as a bucket name e.g. by DuckDB) and the one of each IAM Role Arn")
+
+			core.CfnOutput(self, "S3AccessPointTablePrefixOutput", 
+				value=table_prefix, 
+				description="Prefix of the Glue Table objects, the path of an access point is arn:aws:s3:<region>:<account>:accesspoint/<name>/object/<prefix>")
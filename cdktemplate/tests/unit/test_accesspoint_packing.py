@@ -0,0 +1,36 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import pytest
+
+from stacks.accesspoint_packing import ACCESS_POINT_POLICY_MAX_SIZE, pack_grantees, policy_size
+
+def grantee(n, vpc):
+
+	return {"RoleArn": "arn:aws:iam::%012d:role/consumer-etl-%d" % (n + 1, n), "VpcId": "vpc-%08x" % vpc}
+
+def test_packs_grantees_of_many_accounts_and_vpcs():
+
+	# Each consumer account brings its own role and VPC
+	packed = pack_grantees([grantee(n, n) for n in range(150)])
+
+	assert len(packed) <= 6
+	assert all(policy_size(groups) <= ACCESS_POINT_POLICY_MAX_SIZE for groups in packed)
+
+	role_arns = [role_arn for groups in packed for _, group_role_arns in groups for role_arn in group_role_arns]
+	assert sorted(role_arns) == sorted(grantee(n, n)["RoleArn"] for n in range(150))
+
+def test_groups_roles_by_their_set_of_vpcs():
+
+	packed = pack_grantees([grantee(0, 1), grantee(0, 2), grantee(1, 1), grantee(2, 2), grantee(3, 2), grantee(3, 2)])
+
+	assert packed == [[
+		(("vpc-00000001",), [grantee(1, 1)["RoleArn"]]),
+		(("vpc-00000001", "vpc-00000002"), [grantee(0, 1)["RoleArn"]]),
+		(("vpc-00000002",), [grantee(2, 2)["RoleArn"], grantee(3, 2)["RoleArn"]])
+	]]
+
+def test_rejects_roles_that_do_not_fit_in_a_policy():
+
+	with pytest.raises(ValueError):
+		pack_grantees([grantee(0, 0)], max_size=policy_size([]))
@@ -0,0 +1,81 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import io
+import json
+
+import pytest
+
+pytest.importorskip("boto3")
+pytest.importorskip("pandas")
+
+import s3_access_point_reader as reader
+from row_bloom import ColumnBloomFilters
+from s3_stream import sidecar_key
+
+PREFIX = "nyc_tlc_table"
+
+class FakeAccessPoint(object):
+
+	# Stand-in for the S3 client of the reader, serving the objects written by the loader.
+
+	def __init__(self, objects):
+
+		self.objects = objects
+
+	def get_paginator(self, operation):
+
+		return self
+
+	def paginate(self, Bucket, Prefix):
+
+		return [{"Contents": [{"Key": key} for key in sorted(self.objects) if key.startswith(Prefix)]}]
+
+	def get_object(self, Bucket, Key):
+
+		return {"Body": io.BytesIO(self.objects[Key])}
+
+def load(rows_by_key):
+
+	# Same sidecar as the load function writes for each object, with a Bloom filter on pulocationid
+	objects = {}
+	for key, rows in rows_by_key.items():
+		bloom = ColumnBloomFilters([{"Column": "pulocationid", "Index": "1"}], ",", 0.01)
+		bloom.header(b"vendorid,pulocationid,fare_amount\n")
+		for row in rows:
+			bloom.add(row)
+		objects[key] = b"".join(rows)
+		objects[sidecar_key(PREFIX, key, bloom.kind)] = json.dumps(bloom.result()).encode("utf8")
+	return objects
+
+def test_reader_skips_objects_with_the_filters_of_the_loader(monkeypatch):
+
+	objects = load({
+		PREFIX + "/shard=c4ca-000/data-00000.csv": [b"2,%d,12.5\n" % (n % 50) for n in range(5000)],
+		PREFIX + "/shard=c81e-001/data-00001.csv": [b"1,%d,7.0\r\n" % (100 + n % 50) for n in range(5000)]
+	})
+	monkeypatch.setattr(reader, "_client", lambda: FakeAccessPoint(objects))
+
+	prefix, data_keys, sidecar_keys = reader.list_table_objects("arn", PREFIX + "/")
+	assert data_keys == [PREFIX + "/shard=c4ca-000/data-00000.csv", PREFIX + "/shard=c81e-001/data-00001.csv"]
+	assert len(sidecar_keys) == 2
+
+	def candidates(where):
+		return reader.candidate_keys("arn", prefix, data_keys, sidecar_keys, where)
+
+	assert candidates({"pulocationid": "7"}) == data_keys[:1]
+	# Numbers read by pandas are floats
+	assert candidates({"pulocationid": 107.0}) == data_keys[1:]
+	assert candidates({"pulocationid": [b"49", 149]}) == data_keys
+	assert candidates({"pulocationid": "74"}) == []
+	assert candidates({"fare_amount": "74"}) == data_keys
+
+def test_repeated_values_do_not_fill_the_filters():
+
+	bloom = ColumnBloomFilters([{"Column": "customer_id", "Index": 0}], "\t", 0.01)
+	for n in range(100000):
+		bloom.add(b"%d\tR%d\n" % (n % 1000, n))
+
+	filters = bloom.result()["Columns"]["customer_id"]
+	assert len(filters) == 1
+	assert filters[0]["Count"] <= 1000
@@ -0,0 +1,160 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import functools
+import io
+import random
+
+import pytest
+
+pytest.importorskip("boto3")
+
+import row_cluster
+import s3_copy
+from row_cluster import Clustering, pruning_report
+from s3_throttle import AimdController
+
+SPEC = {"Order": "sort", "Columns": [{"Column": "pickup", "Index": "1", "Type": "string"}]}
+ZORDER_SPEC = {"Order": "zorder", "Columns": [{"Column": "pickup", "Index": "1", "Type": "string"}, {"Column": "zone", "Index": "2", "Type": "number"}]}
+
+class FakeS3(object):
+
+	# In-memory stand-in for the S3 calls of the load function.
+
+	def __init__(self):
+
+		self.objects = {}
+		self.uploads = {}
+
+	def get_object(self, Bucket, Key):
+
+		return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+	def put_object(self, Bucket, Key, Body, **kwargs):
+
+		self.objects[(Bucket, Key)] = bytes(Body)
+		return {}
+
+	def create_multipart_upload(self, Bucket, Key, **kwargs):
+
+		upload_id = str(len(self.uploads))
+		self.uploads[upload_id] = {}
+		return {"UploadId": upload_id}
+
+	def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+
+		self.uploads[UploadId][PartNumber] = bytes(Body)
+		return {"ETag": "etag-%d" % PartNumber}
+
+	def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+
+		parts = self.uploads.pop(UploadId)
+		self.objects[(Bucket, Key)] = b"".join(parts[p["PartNumber"]] for p in MultipartUpload["Parts"])
+		return {}
+
+	def abort_multipart_upload(self, Bucket, Key, UploadId):
+
+		self.uploads.pop(UploadId, None)
+		return {}
+
+	def delete_objects(self, Bucket, Delete):
+
+		for o in Delete["Objects"]:
+			self.objects.pop((Bucket, o["Key"]), None)
+		return {}
+
+def source_rows(count=2000):
+
+	random.seed(7)
+	return [b"2,2020-06-%02d %02d:%02d:00,%d\r\n" % (random.randint(1, 30), random.randint(0, 23), random.randint(0, 59), random.randint(1, 265)) for _ in range(count)]
+
+def in_memory_runs():
+
+	runs = []
+
+	def write_run(lines):
+		runs.append(list(lines))
+		return len(runs) - 1
+
+	return runs, write_run, lambda handle: iter(runs[handle])
+
+def test_sort_keeps_the_line_terminator_of_the_source():
+
+	rows = source_rows(100)
+	_, write_run, read_run = in_memory_runs()
+
+	size, lines = Clustering(SPEC, ",", run_size=1000).sort(iter(rows[:-1] + [rows[-1].rstrip(b"\r\n")]), write_run, read_run)
+	lines = list(lines)
+
+	assert size == sum(len(row) for row in rows)
+	assert sorted(lines) == sorted(rows)
+	assert all(line.endswith(b"\r\n") for line in lines)
+
+@pytest.mark.parametrize("spec", [SPEC, ZORDER_SPEC])
+def test_clustered_load_merges_runs_in_several_passes(spec, monkeypatch, capsys):
+
+	rows = source_rows()
+	s3 = FakeS3()
+	s3.objects[("public", "trips.csv")] = b"vendor,pickup,zone\r\n" + b"".join(rows)[:-2]
+
+	# 10 runs, merged by groups of 3: 10 -> 4 -> 2
+	monkeypatch.setattr(s3_copy, "s3", s3)
+	monkeypatch.setattr(s3_copy, "Clustering", functools.partial(Clustering, run_size=sum(len(row) for row in rows) // 10 + 1))
+	monkeypatch.setattr(row_cluster, "MAX_MERGE_RUNS", 3)
+
+	s3_copy.load_dataset(AimdController("Test"), {
+		"PublicDatasetBucket": "public",
+		"LocalDatasetBucket": "local",
+		"PublicDatasetObject": "trips.csv",
+		"LocalDatasetPrefix": "trips",
+		"LocalDatasetShardPrefixes": ["shard=a", "shard=b"],
+		"LocalDatasetIndexChunkSize": "10000",
+		"LocalDatasetDelimiter": ",",
+		"LocalDatasetClustering": dict(spec, Benchmarks=[])
+	})
+
+	assert [line for line in capsys.readouterr().out.splitlines() if line.startswith("Merging")] == [
+		"Merging 10 sorted runs by groups of 3",
+		"Merging 4 sorted runs by groups of 3",
+		"Merging 2 sorted runs"
+	]
+
+	keys = sorted(key for bucket, key in s3.objects if bucket == "local")
+	assert not [key for key in keys if "/run-" in key]
+
+	data_keys = [key for key in keys if "/_" not in key]
+	assert len(data_keys) == 2
+	lines = []
+	for key in data_keys:
+		header, body = s3.objects[("local", key)].split(b"\r\n", 1)
+		assert header == b"vendor,pickup,zone"
+		lines.extend(body.splitlines(True))
+
+	assert sorted(lines) == sorted(rows)
+
+	clustering = Clustering(spec, ",")
+	clustering.fit(rows)
+	ordered = [clustering.key(line) for line in lines]
+	assert ordered == sorted(ordered)
+
+def test_pruning_report():
+
+	objects = [
+		{
+			"Size": 100,
+			"Min": {"zone": 0.0}, "Max": {"zone": 9.0},
+			"Chunks": [
+				{"Offset": 10, "Min": {"zone": 0.0}, "Max": {"zone": 4.0}},
+				{"Offset": 60, "Min": {"zone": 5.0}, "Max": {"zone": 9.0}}
+			]
+		},
+		{"Size": 100, "Min": {"zone": 10.0}, "Max": {"zone": 19.0}}
+	]
+
+	report = pruning_report([{"Name": "two_zones", "Column": "zone", "Min": "6", "Max": "7"}], objects)
+
+	assert report == [{
+		"Name": "two_zones", "Column": "zone", "Min": "6", "Max": "7",
+		"Bytes": 200, "ObjectPruningRatio": 0.5, "ChunkPruningRatio": 0.8, "Objects": 2
+	}]
+	assert pruning_report([{"Name": "two_zones", "Column": "zone", "Min": "6", "Max": "7"}], objects[:1])[0]["Note"]
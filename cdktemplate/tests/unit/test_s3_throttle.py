@@ -0,0 +1,161 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError, ReadTimeoutError
+
+from s3_throttle import AimdController
+
+def client_error(code, status):
+
+	return ClientError({"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, "PutObject")
+
+class ThrottlingS3(object):
+
+	# Local stand-in for S3 that answers SlowDown whenever more than `capacity` calls are in flight.
+
+	def __init__(self, capacity, latency=0.001):
+
+		self.capacity = capacity
+		self.latency = latency
+		self.in_flight = 0
+		self.peak = 0
+		self.lock = threading.Lock()
+
+	def put_object(self, key):
+
+		with self.lock:
+			self.in_flight += 1
+			self.peak = max(self.peak, self.in_flight)
+			throttled = self.in_flight > self.capacity
+		try:
+			time.sleep(self.latency)
+			if throttled:
+				raise client_error("SlowDown", 503)
+			return key
+		finally:
+			with self.lock:
+				self.in_flight -= 1
+
+class FakeClock(object):
+
+	def __init__(self):
+
+		self.now = 0.0
+
+	def __call__(self):
+
+		return self.now
+
+def test_converges_near_capacity_of_throttling_stand_in():
+
+	s3 = ThrottlingS3(capacity=8)
+	controller = AimdController("Test", initial=2, maximum=32, base_backoff=0.001)
+
+	results = controller.map(s3.put_object, range(3000))
+
+	assert results == list(range(3000))
+	assert controller.counters["Throttles"] > 0
+	# Sawtooth between half the capacity and just above it
+	assert 4 <= controller.limit <= 10
+	assert max(d["limit"] for d in controller.decisions) <= 10
+	assert all(d["limit"] >= 4 for d in controller.decisions if d["action"] == "decrease")
+
+def test_decreases_at_most_once_per_latency_window():
+
+	clock = FakeClock()
+	controller = AimdController("Test", initial=16, clock=clock)
+	controller.on_success(1.0, "put_object")
+
+	for _ in range(5):
+		controller.on_throttle("put_object")
+	assert int(controller.limit) == 8
+	assert controller.counters["Decreases"] == 1
+	assert controller.counters["Throttles"] == 5
+
+	clock.now = 0.5
+	controller.on_throttle("put_object")
+	assert int(controller.limit) == 8
+
+	clock.now = 1.5
+	controller.on_throttle("put_object")
+	assert int(controller.limit) == 4
+	assert [d["action"] for d in controller.decisions] == ["decrease", "decrease"]
+
+def test_ignores_throttles_of_requests_sent_before_the_decrease():
+
+	clock = FakeClock()
+	controller = AimdController("Test", initial=16, clock=clock)
+	controller.on_success(1.0, "put_object")
+
+	clock.now = 1.0
+	controller.on_throttle("put_object", started=0.5)
+	clock.now = 5.0
+	controller.on_throttle("put_object", started=0.5)
+	assert int(controller.limit) == 8
+
+	controller.on_throttle("put_object", started=4.0)
+	assert int(controller.limit) == 4
+
+def test_latency_target_per_operation():
+
+	controller = AimdController("Test", initial=4, latency_target=2.0, latency_targets={"upload_part_copy": 30.0})
+
+	controller.on_success(5.0, "head_object")
+	assert controller.counters["Holds"] == 1
+
+	for _ in range(8):
+		controller.on_success(5.0, "upload_part_copy")
+	assert controller.counters["Holds"] == 1
+	assert controller.limit > 5
+
+def test_retries_server_errors_and_timeouts():
+
+	failures = [client_error("InternalError", 500), ReadTimeoutError(endpoint_url="https://s3")]
+
+	def put_object():
+		if failures:
+			raise failures.pop(0)
+		return "ok"
+
+	controller = AimdController("Test", base_backoff=0, sleep=lambda seconds: None)
+	assert controller.call(put_object) == "ok"
+	assert controller.counters == dict(controller.counters, Requests=3, Errors=2, Throttles=0, Decreases=0)
+
+def test_does_not_retry_client_errors():
+
+	calls = []
+
+	def put_object():
+		calls.append(1)
+		raise client_error("AccessDenied", 403)
+
+	controller = AimdController("Test", sleep=lambda seconds: None)
+	with pytest.raises(ClientError):
+		controller.call(put_object)
+	assert len(calls) == 1
+	assert controller.counters["Errors"] == 1
+
+def test_emit_metrics(capsys):
+
+	s3 = ThrottlingS3(capacity=4)
+	controller = AimdController("Test", initial=2, maximum=16, base_backoff=0.001)
+	controller.map(s3.put_object, range(500))
+
+	controller.emit_metrics({"Bucket": "bucket"})
+	metrics = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+
+	assert metrics["Bucket"] == "bucket"
+	assert metrics["Operation"] == "Test"
+	assert metrics["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["Bucket", "Operation"]]
+	assert metrics["Requests"] == 500 + metrics["Throttles"]
+	assert metrics["Errors"] == 0
+	assert metrics["Increases"] == sum(1 for d in controller.decisions if d["action"] == "increase")
+	assert metrics["Decreases"] == sum(1 for d in controller.decisions if d["action"] == "decrease")
+	assert 0 < metrics["Decreases"] <= metrics["Throttles"]
+	assert metrics["Decisions"] == json.loads(json.dumps(controller.decisions[-50:]))
+	assert metrics["PeakConcurrency"] >= metrics["FinalConcurrency"] == int(controller.limit)
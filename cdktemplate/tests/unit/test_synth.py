@@ -0,0 +1,72 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import glob
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("aws_cdk.aws_lambda")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# CloudFormation quotas for a template passed as TemplateBody, or uploaded to S3 (TemplateURL)
+MAX_TEMPLATE_BODY = 51200
+MAX_TEMPLATE_URL = 1024 * 1024
+MAX_OUTPUTS = 200
+
+def synth(tmp_path, **env):
+
+	# Same entry point as cdk synth, with every stack of app.py
+	outdir = str(tmp_path / "cdk.out")
+	subprocess.run(
+		[sys.executable, "app.py"],
+		cwd=ROOT,
+		env=dict(os.environ, CDK_OUTDIR=outdir, JSII_SILENCE_WARNING_DEPRECATED_NODE_VERSION="1", **env),
+		check=True
+	)
+
+	templates = {}
+	for path in glob.glob(os.path.join(outdir, "*.template.json")):
+		with open(path, encoding="utf8") as fp:
+			templates[os.path.basename(path)[:-len(".template.json")]] = fp.read()
+	return templates
+
+def test_app_synthesizes_every_stack_within_quotas(tmp_path):
+
+	grantees_file = tmp_path / "grantees.json"
+	# One role and VPC in each of 150 consumer accounts
+	grantees_file.write_text(json.dumps([
+		{"RoleArn": "arn:aws:iam::%012d:role/consumer-%d" % (n + 1, n), "VpcId": "vpc-%08d" % n}
+		for n in range(150)
+	]))
+
+	templates = synth(tmp_path, S3_ACCESSPOINT_GRANTEES_FILE=str(grantees_file))
+
+	assert sorted(templates) == [
+		"amazon-reviews-dataset-stack",
+		"nyc-tlc-dataset-stack",
+		"s3-accesspoint-fromtable",
+		"s3-accesspoint-fromtable-grantees"
+	]
+	for name, body in templates.items():
+		# The grantees template grows with the number of grantees, cdk deploy uploads it to S3
+		limit = MAX_TEMPLATE_URL if name.endswith("-grantees") else MAX_TEMPLATE_BODY
+		assert len(body.encode("utf8")) <= limit, name
+		assert len(json.loads(body).get("Outputs", {})) <= MAX_OUTPUTS, name
+
+def test_single_grantee_template_keeps_its_parameter_groups(tmp_path):
+
+	template = json.loads(synth(tmp_path)["s3-accesspoint-fromtable"])
+	interface = template["Metadata"]["AWS::CloudFormation::Interface"]
+
+	assert [g["Label"]["default"] for g in interface["ParameterGroups"]] == [
+		"Lake Formation (Producer Account)",
+		"Source Data Catalog Resource (Producer Account)",
+		"Grantee IAM Role (Consumer Account)"
+	]
+	assert interface["ParameterGroups"][2]["Parameters"] == ["GranteeIAMRoleARN", "GranteeVPC"]
+	assert sorted(interface["ParameterLabels"]) == sorted(["LakeFormationParam", "GlueDatabaseName", "GlueTableName", "GranteeIAMRoleARN", "GranteeVPC"])
@@ -0,0 +1,102 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Consumer side SQL over the objects of a Glue Table shared through an S3 Access Point, using
+# DuckDB as an embedded engine. Objects are read in place through the access point alias
+# (S3AccessPointAliasOutput) with ranged GETs: for Parquet, only the footers and the row
+# groups and columns that survive projection and filter pushdown are fetched. Text objects
+# (CSV/TSV) are scanned, skipping the objects whose Bloom filter or min/max statistics
+# sidecars rule out the values passed as where or the ranges passed as ranges.
+
+import boto3
+import duckdb
+from botocore.exceptions import ClientError
+
+from s3_access_point_reader import candidate_keys, list_table_objects
+
+PARQUET_SUFFIXES = (".parquet", ".parq")
+
+def connect(access_point=None):
+
+	con = duckdb.connect()
+	con.execute("INSTALL httpfs")
+	con.execute("LOAD httpfs")
+
+	session = boto3.Session()
+	region = access_point_region(access_point) if access_point else None
+	region = region or session.region_name
+	if region:
+		con.execute("SET s3_region = %s" % _sql_value(region))
+	refresh_credentials(con, session)
+
+	return con
+
+def access_point_region(access_point):
+
+	# The region of an access point ARN is in the ARN itself, an alias must be asked to S3: the
+	# region is returned in a header, also with errors (e.g. if the role cannot list the bucket).
+	if access_point.startswith("arn:"):
+		return access_point.split(":")[3]
+
+	try:
+		response = boto3.client("s3").head_bucket(Bucket=access_point)
+	except ClientError as e:
+		response = e.response
+	return response.get("ResponseMetadata", {}).get("HTTPHeaders", {}).get("x-amz-bucket-region")
+
+def refresh_credentials(con, session=None):
+
+	# DuckDB only gets a snapshot of the credentials. Temporary credentials (e.g. of the role of
+	# a notebook instance) expire, so they are set again every time a table is registered, and
+	# boto3 renews them when they are close to their expiration.
+	credentials = (session or boto3.Session()).get_credentials().get_frozen_credentials()
+
+	settings = {
+		"s3_access_key_id": credentials.access_key,
+		"s3_secret_access_key": credentials.secret_key,
+		"s3_session_token": credentials.token or ""
+	}
+	for setting, value in settings.items():
+		con.execute("SET %s = %s" % (setting, _sql_value(value)))
+
+def _sql_value(value):
+
+	if isinstance(value, bool):
+		return "true" if value else "false"
+	if isinstance(value, (int, float)):
+		return str(value)
+	return "'%s'" % str(value).replace("'", "''")
+
+def _sql_list(values):
+
+	return "[%s]" % ", ".join(_sql_value(value) for value in values)
+
+def register_table(con, name, access_point_alias, table_prefix, where=None, ranges=None, **csv_options):
+
+	refresh_credentials(con)
+
+	# The view lists the table objects explicitly, so sidecars (_index/, ...) are never read.
+	prefix, data_keys, sidecar_keys = list_table_objects(access_point_alias, table_prefix)
+	data_keys = candidate_keys(access_point_alias, prefix, data_keys, sidecar_keys, where, ranges)
+	if not data_keys:
+		raise ValueError("No objects found under %s in %s" % (table_prefix, access_point_alias))
+
+	urls = ["s3://%s/%s" % (access_point_alias, key) for key in data_keys]
+
+	if all(key.endswith(PARQUET_SUFFIXES) for key in data_keys):
+		source = "read_parquet(%s, hive_partitioning = true)" % _sql_list(urls)
+	else:
+		options = "".join(", %s = %s" % (k, _sql_value(v)) for k, v in dict({"header": True}, **csv_options).items())
+		source = "read_csv_auto(%s, hive_partitioning = true%s)" % (_sql_list(urls), options)
+
+	con.execute('CREATE OR REPLACE VIEW "%s" AS SELECT * FROM %s' % (name, source))
+
+def query(sql, access_point_alias, table_prefix, table_name="dataset", con=None, where=None, ranges=None, **csv_options):
+
+	# e.g. query("SELECT pulocationid, count(*) FROM dataset GROUP BY 1", "nyc-tlc-table-51198860-...-s3alias", "nyc_tlc_table/")
+	# where ({column: values}) and ranges ({column: (low, high)}) only prune objects, the SQL
+	# must still filter the rows: query("SELECT * FROM dataset WHERE review_id = 'R1'", ..., where={"review_id": "R1"})
+	con = con or connect(access_point_alias)
+	register_table(con, table_name, access_point_alias, table_prefix, where, ranges, **csv_options)
+
+	return con.execute(sql).df()
@@ -0,0 +1,185 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Consumer side reader for the objects of a Glue Table shared through an S3 Access Point.
+# Uncompressed objects with a record index sidecar (see LocalDatasetIndexChunkSize in the
+# dataset stacks) are read as record-aligned byte ranges, fetched and parsed in parallel on
+# separate cores. Other objects are read whole. Objects with a Bloom filter sidecar (see
+# LocalDatasetBloomFilterColumns) can be skipped when they cannot contain the looked up values,
+# and objects or chunks with min/max statistics (see LocalDatasetClustering) when they are out
+# of the looked up ranges.
+
+import base64
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import boto3
+import pandas as pd
+
+_s3 = None
+_s3_pid = None
+
+def _client():
+
+	# boto3 clients are not fork safe, so each worker process creates its own.
+	global _s3, _s3_pid
+	if _s3 is None or _s3_pid != os.getpid():
+		_s3 = boto3.client("s3")
+		_s3_pid = os.getpid()
+	return _s3
+
+def sidecar_key(prefix, key, kind):
+
+	# Same layout as the loader: <prefix>/_<kind>/<key relative to prefix>.json
+	return "%s/_%s/%s.json" % (prefix, kind, key[len(prefix) + 1:])
+
+def is_sidecar(prefix, key):
+
+	return any(part.startswith("_") for part in key[len(prefix) + 1:].split("/"))
+
+def list_table_objects(access_point_arn, table_prefix):
+
+	prefix = table_prefix.rstrip("/")
+	keys = []
+
+	paginator = _client().get_paginator("list_objects_v2")
+	for page in paginator.paginate(Bucket=access_point_arn, Prefix=prefix + "/"):
+		keys.extend(o["Key"] for o in page.get("Contents", []))
+
+	data_keys = [key for key in keys if not is_sidecar(prefix, key)]
+	sidecar_keys = set(key for key in keys if is_sidecar(prefix, key))
+
+	return prefix, data_keys, sidecar_keys
+
+def read_sidecar(access_point_arn, prefix, key, kind, sidecar_keys):
+
+	sidecar = sidecar_key(prefix, key, kind)
+	if sidecar not in sidecar_keys:
+		return None
+
+	body = _client().get_object(Bucket=access_point_arn, Key=sidecar)["Body"].read()
+	return json.loads(body)
+
+def field_text(value):
+
+	# Filters hold the text of the fields as written in the source file, e.g. "74" for a
+	# column read by pandas as 74.0. Other values (e.g. "2.50" or dates) must be given as text.
+	if isinstance(value, bytes):
+		return value
+	if isinstance(value, float) and value.is_integer():
+		value = int(value)
+	return str(value).encode("utf8")
+
+def _value_hashes(value):
+
+	# Same hashing as the loader (lambda/row_bloom.py), over the raw field bytes
+	digest = hashlib.md5(field_text(value)).digest()
+	return int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big")
+
+def read_bloom_filters(access_point_arn, prefix, key, sidecar_keys):
+
+	# Filters are decoded once per object, not for every value looked up.
+	bloom = read_sidecar(access_point_arn, prefix, key, "bloom", sidecar_keys)
+	if bloom is None:
+		return {}
+
+	return dict(
+		(column, [dict(f, Data=base64.b64decode(f["Data"])) for f in filters])
+		for column, filters in bloom["Columns"].items()
+	)
+
+def may_contain(filters, value):
+
+	h1, h2 = _value_hashes(value)
+	for f in filters:
+		positions = ((h1 + i * h2) % f["Bits"] for i in range(f["Hashes"]))
+		if all(f["Data"][p >> 3] & (1 << (p & 7)) for p in positions):
+			return True
+	return False
+
+def in_ranges(stats, ranges):
+
+	# ranges: {column: (low, high)}. Statistics are kept for the clustering columns only.
+	for column, (low, high) in ranges.items():
+		if column not in stats["Min"]:
+			continue
+		if stats["Min"][column] is None:
+			return False
+		if isinstance(stats["Min"][column], float):
+			low, high = float(low), float(high)
+		if high < stats["Min"][column] or low > stats["Max"][column]:
+			return False
+	return True
+
+def candidate_keys(access_point_arn, prefix, data_keys, sidecar_keys, where, ranges=None):
+
+	# where: {column: value or [values]}, matched against the text of the fields (see field_text).
+	# Keeps the objects that may contain one of the values of every column; objects without a
+	# Bloom filter for a column are always kept.
+	# ranges: {column: (low, high)}. Keeps the objects whose statistics overlap every range.
+	if not where and not ranges:
+		return data_keys
+
+	where = dict((column, values if isinstance(values, (list, tuple, set)) else [values]) for column, values in (where or {}).items())
+
+	keys = []
+	for key in data_keys:
+		if ranges:
+			stats = read_sidecar(access_point_arn, prefix, key, "stats", sidecar_keys)
+			if stats is not None and not in_ranges(stats, ranges):
+				continue
+
+		columns = read_bloom_filters(access_point_arn, prefix, key, sidecar_keys) if where else {}
+		if all(column not in columns or any(may_contain(columns[column], value) for value in values) for column, values in where.items()):
+			keys.append(key)
+
+	print("Sidecars kept %d of %d objects" % (len(keys), len(data_keys)))
+	return keys
+
+def _read_part(task):
+
+	access_point_arn, key, header_size, offset, length, read_csv_kwargs = task
+	s3 = _client()
+
+	if offset is None:
+		data = s3.get_object(Bucket=access_point_arn, Key=key)["Body"].read()
+	else:
+		header = s3.get_object(Bucket=access_point_arn, Key=key, Range="bytes=0-%d" % (header_size - 1))["Body"].read()
+		data = header + s3.get_object(Bucket=access_point_arn, Key=key, Range="bytes=%d-%d" % (offset, offset + length - 1))["Body"].read()
+
+	if key.endswith(".gz"):
+		read_csv_kwargs = dict(read_csv_kwargs, compression="gzip")
+
+	return pd.read_csv(io.BytesIO(data), **read_csv_kwargs)
+
+def read_table_csv(access_point_arn, table_prefix, max_workers=None, where=None, ranges=None, **read_csv_kwargs):
+
+	# e.g. read_table_csv("arn:aws:s3:us-east-1:111122223333:accesspoint/nyc-tlc-table-51198860", "nyc_tlc_table/")
+	# where and ranges only skip objects and chunks (see candidate_keys), the rows read are not filtered.
+	prefix, data_keys, sidecar_keys = list_table_objects(access_point_arn, table_prefix)
+	data_keys = candidate_keys(access_point_arn, prefix, data_keys, sidecar_keys, where, ranges)
+
+	tasks = []
+	for key in data_keys:
+		index = read_sidecar(access_point_arn, prefix, key, "index", sidecar_keys)
+		if index is None or key.endswith(".gz"):
+			tasks.append((access_point_arn, key, None, None, None, read_csv_kwargs))
+			continue
+
+		stats = read_sidecar(access_point_arn, prefix, key, "stats", sidecar_keys) if ranges else None
+		chunk_stats = dict((c["Offset"], c) for c in stats.get("Chunks", [])) if stats else {}
+		for chunk in index["Chunks"]:
+			if chunk["Offset"] in chunk_stats and not in_ranges(chunk_stats[chunk["Offset"]], ranges):
+				continue
+			tasks.append((access_point_arn, key, index["HeaderSize"], chunk["Offset"], chunk["Length"], read_csv_kwargs))
+
+	if not tasks:
+		return pd.DataFrame()
+
+	with ProcessPoolExecutor(max_workers=max_workers) as pool:
+		frames = list(pool.map(_read_part, tasks))
+
+	return pd.concat(frames, ignore_index=True)